@@ -1,28 +1,66 @@
 import os
+import asyncio
+import json
+import time
+import httpx
 from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, END, START
-from langchain_core.messages import HumanMessage
-from langgraph.prebuilt import ToolNode
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
 from typing_extensions import TypedDict, Literal
 from tools import read_tools, read_write_tools
 from typing import Annotated
 from langgraph.graph.message import add_messages
 from dotenv import load_dotenv
-from langgraph.types import Command
+from langgraph.types import Command, StreamWriter
+from llm_cache import CachedChatModel
+from loop_guard import stop_reason, wrap_up_prompt
+from compaction import CHARS_PER_TOKEN, compact_messages
+from tool_node import ParallelToolNode, ReadCache
+from metrics import TOKEN_BUCKETS, inc, observe, span
+from rate_limiter import RateLimitedChatModel, RateLimiter, request_priority
+from workspace import REPOS_ROOT, Workspace
 
 load_dotenv()
 LITELLM_BASE_URL = os.getenv("LITELLM_BASE_URL")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
-
-def run_agents(index, problem_statement, name, url, key):
-
-    def planner_prompt(index, problem_statement, name):
-        return f"""You are the Planner in a team of agents working collaboratively to fix a software issue. Your job is to analyze the provided problem description and create an actionable, step-by-step blueprint for the Coder to implement.
-
-                - Use the available file inspection tools to read and understand the relevant source files in `repo_{index}/{name}` before planning.
-                - Use the list_files_in_repository tool only once!
-                - Identify the root cause of the test failures or bug described below.
+MODEL = "gpt-4o-mini"
+# Estimated prompt tokens per LLM call above which the context is compacted
+PLANNER_TOKEN_BUDGET = 60000
+CODER_TOKEN_BUDGET = 60000
+# Connections kept open to the LLM endpoint, shared by all tasks of a runtime
+MAX_CONNECTIONS = 100
+# Estimated tokens of the planner's file reads the coder starts with
+CODER_SEED_TOKEN_BUDGET = 12000
+# Times the coder is sent back with the output of failing local tests
+MAX_TEST_FEEDBACK_ROUNDS = 2
+
+
+# Graph state
+class State(TypedDict):
+    # messages: Annotated[list, add_messages]
+    planner_messages: Annotated[list, add_messages]
+    coder_messages: Annotated[list, add_messages]
+    index: str
+    name: str
+    problem_statement: str
+    planner_result: str
+    coder_result: str
+    fail_tests: list
+    test_rounds: int
+    tester_result: dict
+
+
+# The system prompts are identical for all tasks and turns, so the provider can serve them, and
+# the tool definitions before them, from its prompt cache
+PLANNER_SYSTEM_PROMPT = """You are the Planner in a team of agents working collaboratively to fix a software issue. Your job is to analyze the provided problem description and create an actionable, step-by-step blueprint for the Coder to implement.
+
+                - Use the available file inspection tools to read and understand the relevant source files of the repository before planning. All paths are relative to the repository root.
+                - Use the 'list_files_in_repository' tool with a subdirectory or pattern (e.g. "*.py") instead of listing the whole repository.
+                - Call independent tools together in one turn (e.g. read several files at once), they run in parallel.
+                - Use the 'search_repository' tool to locate classes, functions and code by name or text instead of reading files to find them.
+                - For large files, call 'get_file_content' with outline=True first and then read only the relevant line ranges.
+                - Identify the root cause of the test failures or bug described in the problem description.
                 - For each coding task, specify:
                   1. The objective of the change.
                   2. The exact file path(s) to modify.
@@ -31,24 +69,13 @@ def run_agents(index, problem_statement, name, url, key):
                 - Ensure changes are minimal and scoped only to what is necessary.
                 - Call the appropriate file-reading tool whenever you refer to a file, e.g., `read_file("path/to/file")`.
                 - List any edge cases or test scenarios that must be covered.
-                - Use the 'list_files_in_repository' tool only once!
                 
                 Your output should be a numbered list of instructions the Coder can follow in sequence.
-                
-                Problem description:
-                {problem_statement}
-                
-                USE THE 'list_files_in_repository' TOOL ONLY ONCE!!!!
                 """
 
-
-    def coder_prompt(index, problem_statement, name, planner_result):
-
-        return f"""You are the Coder in a team of agents working collaboratively to fix a software issue. Your role is to implement the code changes based on the plan provided by the Planner. 
-        
-        You are working in the Git repository directory: `repo_{index}/{name}`.
+CODER_SYSTEM_PROMPT = """You are the Coder in a team of agents working collaboratively to fix a software issue. Your role is to implement the code changes based on the plan provided by the Planner. 
         
-        When using the tools always use the 'repo=repo_{index}/{name}' flag to specify the repository.
+        The tools work on the Git repository of the issue, and all file paths are relative to its root.
 
 
         **Task:**
@@ -59,131 +86,441 @@ def run_agents(index, problem_statement, name, url, key):
         - Follow good coding practices and maintain consistency with the surrounding code.
 
         **Additional Rules:**
-        - NEVER Execute two tools at once. Always in Sequence
+        - Call independent read tools together in one turn (e.g. read several files at once), they run in parallel.
+        - Make edits to the same file one after another, each after you saw the result of the previous one.
         - Use the tools provided to you to inspect the files and understand the code.
-        - Use the 'list_files_in_repository' tool only once!
-        - Use the 'find_and_replace' tool to update the files
+        - Use the 'list_files_in_repository' tool with a subdirectory or pattern instead of listing the whole repository.
+        - Use the 'search_repository' tool to locate code by symbol name or text.
+        - Read only the line ranges you need with 'get_file_content' (use outline=True to find them).
+        - Use the 'apply_edits' tool to update the files: submit all edits of a step, to one or more files, in a single call and check the returned diff.
+        - Prefer 'replace' edits with the exact old text over line numbers; if an edit fails, nothing was changed, so fix it and submit the whole call again.
 
         Do not make unrelated changes or refactor parts of the code not involved in this fix. Once changes are made, hand off the task to the Tester for validation.
-
-        Problem description:
-        {problem_statement}
-        
-        Planner Instrucitons:
-        {planner_result}
-        
-        USE THE 'list_files_in_repository' TOOL ONLY ONCE!!!!
         """
 
 
-    # Initialize the LLM with read tools
-    llm_read = ChatOpenAI(model="gpt-4o-mini",api_key=OPENAI_API_KEY)
-    llm_with_read_tools = llm_read.bind_tools(read_tools)
+def planner_prompt(index, problem_statement, name):
+    return f"""Repository: `{name}`
 
-    # Initialize the LLM with read/write tools
-    llm_read_write = ChatOpenAI(model="gpt-4o-mini",api_key=OPENAI_API_KEY)
-    llm_with_read_write_tools = llm_read_write.bind_tools(read_write_tools)
+Problem description:
+{problem_statement}
+"""
 
-    # Graph state
-    class State(TypedDict):
-        # messages: Annotated[list, add_messages]
-        planner_messages: Annotated[list, add_messages]
-        coder_messages: Annotated[list, add_messages]
-        index: str
-        problem_statement: str
-        planner_result: str
-        coder_result: str
-        tester_result: str
 
-    # Nodes
-    def planner(state: State) -> Command[Literal["tool_node_planner", "coder"]]:
+def coder_prompt(index, problem_statement, name, planner_result, seeded_files=()):
+    prompt = f"""Repository: `{name}`
+
+Problem description:
+{problem_statement}
+
+Planner instructions:
+{planner_result}
+"""
+    if seeded_files:
+        prompt += (f"\nThe contents the Planner read of {', '.join(f'`{path}`' for path in seeded_files)} "
+                   f"follow in the conversation; do not read them again.\n")
+    return prompt
+
+
+def tester_feedback(result):
+    failed = "\n".join(f"- {test}" for test in result["failed"])
+    return f"""The Tester ran the failing tests of the issue against your changes, and these still fail:
+{failed}
+
+Test output:
+{result["output"]}
+
+Find the cause in the code and fix it with the tools, then finish again. Do not change the tests."""
+
+
+class AgentRuntime:
+    """
+    The compiled agent graph together with its LLM clients. Build it once and run any number of
+    tasks on it, also concurrently: all task data travels in the graph state, and the LLM clients
+    share one pool of keep-alive connections to the endpoint.
+
+    Agents that exhaust their tool call or token budget, or keep repeating earlier tool calls,
+    are stopped (see loop_guard): the planner writes its plan from what it found so far, the
+    coder hands over as it is.
+
+    With a test_runner (see local_tests.LocalTestRunner), the tester runs the FAIL_TO_PASS
+    tests of a task after the coder finished and sends the coder back with the failures, at
+    most MAX_TEST_FEEDBACK_ROUNDS times.
+
+    All LLM requests pass one rate limiter, which also retries failed requests; by default it
+    enforces no limits. Requests of coders are served before those of planners, and later turns
+    before earlier ones, so tasks close to completion finish first when the endpoint is busy.
+
+    With a checkpointer, the graph state of every task is saved after each node under the thread
+    id "task-<index>", and interrupted tasks can be resumed from their last completed node.
+
+    The async HTTP client binds to the event loop it is first used on, so a runtime must only be
+    used from one event loop. Call aclose() when done.
+    """
 
+    def __init__(self, url=LITELLM_BASE_URL, key=OPENAI_API_KEY, llm_cache=None, max_connections=MAX_CONNECTIONS,
+                 checkpointer=None, llm=None, test_runner=None, rate_limiter=None):
+        self.url = url
+        self.checkpointer = checkpointer
+        self.test_runner = test_runner
+        self.rate_limiter = rate_limiter or RateLimiter()
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.http_client = httpx.Client(limits=limits)
+        self.http_async_client = httpx.AsyncClient(limits=limits)
+
+        # Any chat model with bind_tools can stand in for the endpoint, e.g. a scripted one in benchmarks
+        # Retries are left to the rate limiter, which knows about all requests in flight
+        llm = llm or ChatOpenAI(model=MODEL, api_key=key, http_client=self.http_client,
+                                http_async_client=self.http_async_client, max_retries=0)
+        # Bind the LLM to the read tools and to the read/write tools
+        self.llm_with_read_tools = RateLimitedChatModel(llm.bind_tools(read_tools, parallel_tool_calls=True),
+                                                        self.rate_limiter)
+        self.llm_with_read_write_tools = RateLimitedChatModel(
+            llm.bind_tools(read_write_tools, parallel_tool_calls=True), self.rate_limiter)
+
+        # Replay identical requests of earlier runs from the response cache
+        if llm_cache is not None:
+            self.llm_with_read_tools = CachedChatModel(self.llm_with_read_tools, llm_cache, MODEL, read_tools)
+            self.llm_with_read_write_tools = CachedChatModel(self.llm_with_read_write_tools, llm_cache, MODEL,
+                                                             read_write_tools)
+
+        self.planner_tools = ParallelToolNode(read_tools, messages_key="planner_messages")
+        self.coder_tools = ParallelToolNode(read_write_tools, messages_key="coder_messages")
+        self.graph = self._build_graph()
+
+    async def _invoke_llm(self, agent, llm, messages, compaction_saved_tokens=0):
+        """
+        Calls the LLM and records the latency and the token usage of the call, including the input
+        tokens the provider read from its prompt cache and the tokens compaction removed from
+        messages. The latter are kept in the response metadata for the llm_response event.
+        """
+        # Coder requests come after all planner requests of a task, and longer histories are further along
+        priority = (1000 if agent == "coder" else 0) + len(messages)
+        with span("llm_request", agent=agent, model=MODEL), request_priority(priority):
+            msg = await llm.ainvoke(messages)
+        usage = msg.usage_metadata or {}
+        for kind in ("input", "output"):
+            tokens = usage.get(f"{kind}_tokens", 0)
+            observe(f"llm_{kind}_tokens", tokens, TOKEN_BUCKETS, agent=agent, model=MODEL)
+            inc("llm_tokens", tokens, agent=agent, model=MODEL, kind=kind)
+        inc("llm_tokens", _cached_tokens(usage), agent=agent, model=MODEL, kind="cache_read")
+        observe("compaction_saved_tokens", compaction_saved_tokens, TOKEN_BUCKETS, agent=agent)
+        msg.response_metadata["compaction_saved_tokens"] = compaction_saved_tokens
+        return msg
+
+    # Nodes
+    async def planner(self, state: State, config: RunnableConfig,
+                      writer: StreamWriter) -> Command[Literal["tool_node_planner", "coder"]]:
+        writer({"event": "node_started", "node": "planner"})
         print(f"Planner working...")
-        msg = llm_with_read_tools.invoke(state["planner_messages"])
+        wrap_up = []
+        stop = stop_reason("planner", state["planner_messages"])
+        if stop is not None:
+            self._on_stop("planner", stop, writer)
+            wrap_up = [HumanMessage(content=wrap_up_prompt(stop[1]))]
+        messages, tokens_before, tokens_after = compact_messages(state["planner_messages"] + wrap_up,
+                                                                 PLANNER_TOKEN_BUDGET)
+        print(f"Planner context: ~{tokens_after} tokens (compaction saved ~{tokens_before - tokens_after})")
+        msg = await self._invoke_llm("planner", self.llm_with_read_tools, messages, tokens_before - tokens_after)
         print(f"Planner recieved message")
 
-        # record assistant response
-        # state["messages"].append(msg)
-        state["planner_messages"].append(msg)
-
         # if message is tool call command to go to tool
-        if isinstance(state, list):
-            ai_message = state[-1]
-        elif messages := state.get("planner_messages", []):
-            ai_message = messages[-1]
-        if hasattr(ai_message, "tool_calls") and len(ai_message.tool_calls) > 0:
+        if len(msg.tool_calls) > 0 and not wrap_up:
             return Command(
+                update={"planner_messages": [msg]},
                 goto="tool_node_planner",
             )
-        else:
-            # if message is no tool command to go to coder
-            # append coder message and go to coder
+        if msg.tool_calls:
+            # Tool calls despite the wrap-up are dropped, the plan is what the planner wrote
+            msg = AIMessage(content=msg.content, usage_metadata=msg.usage_metadata,
+                            response_metadata=msg.response_metadata)
+
+        # if message is no tool command to go to coder
+        # append coder message and go to coder
+        # Start the coder with what the planner read of the files in its plan, from the shared read cache
+        seed_calls = _seed_calls(state["planner_messages"], msg.content)
+        seed_messages = []
+        if seed_calls:
+            seed = AIMessage(content="", tool_calls=seed_calls)
+            results = await self.coder_tools.ainvoke({"coder_messages": [seed]}, config)
+            seed_messages = [seed, *results["coder_messages"]]
+            print(f"Coder starts with {len(seed_calls)} file read(s) of the planner")
+        seeded_files = list(dict.fromkeys(call["args"]["file_path"] for call in seed_calls))
+        coder = coder_prompt(state["index"], state["problem_statement"], state["name"], msg.content, seeded_files)
+        print(f"Coder Prompt: {coder}")
+        coder_messages = [SystemMessage(content=CODER_SYSTEM_PROMPT), HumanMessage(content=coder), *seed_messages]
+        return Command(
+            update={
+                "planner_messages": [*wrap_up, msg],
+                "planner_result": msg.content,
+                "coder_messages": coder_messages,
+            },
+            goto="coder",
+        )
 
-            coder = coder_prompt(index, problem_statement, name, msg.content)
-            print(f"Coder Prompt: {coder}")
-            return Command(
-                update={
-                    "planner_result": msg.content,
-                    "coder_messages": [HumanMessage(content=coder)],
-                    # "messages": state["messages"] +
-                    #             [HumanMessage(content=coder_prompt(index, problem_statement, name, msg.content))]
-                                },
-                goto="coder",
-            )
+    async def tool_node_planner(self, state: State, config: RunnableConfig, writer: StreamWriter):
+        writer({"event": "node_started", "node": "tool_node_planner"})
+        return await self.planner_tools.ainvoke(state, config)
 
-    tool_node_planner = ToolNode(tools=read_tools, messages_key="planner_messages")
-    tool_node_coder = ToolNode(tools=read_write_tools, messages_key="coder_messages")
+    async def tool_node_coder(self, state: State, config: RunnableConfig, writer: StreamWriter):
+        writer({"event": "node_started", "node": "tool_node_coder"})
+        return await self.coder_tools.ainvoke(state, config)
 
-    def coder(state: State) -> Command[Literal["tool_node_coder", END]]:
+    async def coder(self, state: State, writer: StreamWriter) -> Command[Literal["tool_node_coder", "tester", END]]:
+        writer({"event": "node_started", "node": "coder"})
         print(f"Coder working...")
-        msg = llm_with_read_write_tools.invoke(state["coder_messages"])
+        stop = stop_reason("coder", state["coder_messages"])
+        if stop is not None:
+            self._on_stop("coder", stop, writer)
+            return Command(update={"coder_result": f"Stopped: the coder {stop[1]}."}, goto=self._after_coder(state))
+        messages, tokens_before, tokens_after = compact_messages(state["coder_messages"], CODER_TOKEN_BUDGET)
+        print(f"Coder context: ~{tokens_after} tokens (compaction saved ~{tokens_before - tokens_after})")
+        msg = await self._invoke_llm("coder", self.llm_with_read_write_tools, messages,
+                                     tokens_before - tokens_after)
         print(f"Coder recieved message")
-        # state["messages"].append(msg)
-        state["coder_messages"].append(msg)
 
         # if message is tool call command to go to tool
-        if isinstance(state, list):
-            ai_message = state[-1]
-        elif messages := state.get("coder_messages", []):
-            ai_message = messages[-1]
-        if hasattr(ai_message, "tool_calls") and len(ai_message.tool_calls) > 0:
+        if len(msg.tool_calls) > 0:
             return Command(
+                update={"coder_messages": [msg]},
                 goto="tool_node_coder",
             )
 
-        # if message is no tool command to go to end
+        # if message is no tool command to go to the tester, or to end without tests to run
         print(f"Coder result: {msg.content}")
         return Command(
-            update={"coder_result": msg.content},
-            goto=END,
+            update={"coder_messages": [msg], "coder_result": msg.content},
+            goto=self._after_coder(state),
         )
 
+    def _after_coder(self, state):
+        return "tester" if self.test_runner is not None and state.get("fail_tests") else END
+
+    @staticmethod
+    def _on_stop(agent, stop, writer):
+        kind, reason = stop
+        writer({"event": "agent_stopped", "agent": agent, "reason": kind})
+        inc("agents_stopped", agent=agent, reason=kind)
+        print(f"{agent.capitalize()} {reason}, stopping it")
+
+    async def tester(self, state: State, config: RunnableConfig,
+                     writer: StreamWriter) -> Command[Literal["coder", END]]:
+        writer({"event": "node_started", "node": "tester"})
+        tests = state["fail_tests"]
+        rounds = state.get("test_rounds", 0) + 1
+        print(f"Tester running {len(tests)} FAIL_TO_PASS test(s), round {rounds}...")
+        result = await self.test_runner.run(config["configurable"]["workspace"].root, tests)
+        writer({"event": "tests_finished", "status": result["status"], "passed": len(result["passed"]),
+                "total": len(tests), "round": rounds, "duration": result["duration"]})
+        print(f"Tester result: {result['status']}, {len(result['passed'])}/{len(tests)} passed")
+        update = {"test_rounds": rounds, "tester_result": {**result, "rounds": rounds}}
+
+        # Only failures the tests conclusively report go back to the coder, if it may go on
+        if (result["status"] != "failed" or rounds > MAX_TEST_FEEDBACK_ROUNDS
+                or stop_reason("coder", state["coder_messages"]) is not None):
+            return Command(update=update, goto=END)
+        return Command(
+            update={**update, "coder_messages": [HumanMessage(content=tester_feedback(result))]},
+            goto="coder",
+        )
 
+    def _build_graph(self):
+        graph_builder = StateGraph(State)
 
-    graph_builder = StateGraph(State)
-
-    graph_builder.add_node("planner", planner)
-    graph_builder.add_node("coder", coder)
-    # graph_builder.add_node("tester", tester)
-    graph_builder.add_node("tool_node_planner", tool_node_planner)
-    graph_builder.add_node("tool_node_coder", tool_node_coder)
-
+        graph_builder.add_node("planner", self.planner)
+        graph_builder.add_node("coder", self.coder)
+        graph_builder.add_node("tester", self.tester)
+        graph_builder.add_node("tool_node_planner", self.tool_node_planner)
+        graph_builder.add_node("tool_node_coder", self.tool_node_coder)
 
-    # Any time a tool is called, we return to the chatbot to decide the next step
-    graph_builder.add_edge(START, "planner")
+        # Any time a tool is called, we return to the chatbot to decide the next step
+        graph_builder.add_edge(START, "planner")
 
+        graph_builder.add_edge("tool_node_planner", "planner")
+        graph_builder.add_edge("tool_node_coder", "coder")
 
-    graph_builder.add_edge("tool_node_planner", "planner")
-    graph_builder.add_edge("tool_node_coder", "coder")
+        # Compile
+        return graph_builder.compile(checkpointer=self.checkpointer)
 
+    @staticmethod
+    def _config(index, workspace=None):
+        configurable = {"thread_id": f"task-{index}"}
+        if workspace is not None:
+            # The tools resolve all paths in the workspace of the task, and its agents share their reads
+            configurable["workspace"] = workspace
+            configurable["read_cache"] = ReadCache()
+        return {"recursion_limit": 100, "configurable": configurable}
 
-    # Compile
-    graph = graph_builder.compile()
+    async def checkpoint_status(self, index):
+        """
+        Returns "completed" if a checkpointed run of the task finished, "interrupted" if one
+        stopped midway and None if there is no checkpoint.
+        """
+        if self.checkpointer is None:
+            return None
+        snapshot = await self.graph.aget_state(self._config(index))
+        if not snapshot.values:
+            return None
+        return "interrupted" if snapshot.next else "completed"
+
+    async def discard_checkpoint(self, index):
+        """
+        Deletes the checkpoints of the task, if there are any.
+        """
+        if self.checkpointer is not None:
+            await self.checkpointer.adelete_thread(self._config(index)["configurable"]["thread_id"])
 
-    # Invoke
-    state = graph.invoke({"index": index,
-                          "problem_statement": problem_statement,
-                          "planner_messages": [HumanMessage(content=planner_prompt(index, problem_statement, name))],
-                          # "messages": [HumanMessage(content=planner_prompt(index, problem_statement, name))]
-                          },
-                         {"recursion_limit": 100})
+    async def astream(self, index, problem_statement, name, resume=False, workspace=None, fail_tests=None):
+        """
+        Runs the agent system on a task and yields progress events as dicts with an "event" type
+        and the seconds elapsed since the start. The tools work in workspace, by default the
+        checkout repo_<index>/<name> below REPOS_ROOT. fail_tests are the FAIL_TO_PASS tests the
+        tester runs, if the runtime has a test runner. With resume, a checkpointed run of the task
+        continues from its last completed node, or returns its final state if it finished;
+        otherwise any checkpoint of the task is discarded and the task starts over.
+
+        - node_started: a graph node started (node)
+        - llm_response: an agent received an LLM response (agent, input_tokens, output_tokens, cached_tokens,
+          compaction_saved_tokens, tool_calls)
+        - tool_called: an agent called a tool (agent, tool, args)
+        - tool_result: a tool call finished (agent, tool, status, characters)
+        - agent_stopped: an agent was stopped for its budget or for repeating itself (agent, reason)
+        - tests_finished: the tester ran the tests (status, passed, total, round, duration)
+        - node_finished: a graph node finished (node)
+        - resumed: a checkpointed run is continued (next nodes) or was already complete (no next nodes)
+        - done: the graph finished (state); always the last event
+        """
+        inputs = {"index": index,
+                  "name": name,
+                  "problem_statement": problem_statement,
+                  "fail_tests": list(fail_tests or []),
+                  "planner_messages": [SystemMessage(content=PLANNER_SYSTEM_PROMPT),
+                                       HumanMessage(content=planner_prompt(index, problem_statement, name))],
+                  }
+        workspace = workspace or Workspace(os.path.join(REPOS_ROOT, f"repo_{index}", name))
+        config = self._config(index, workspace)
+        start_time = time.monotonic()
+        state = {}
+        if self.checkpointer is not None:
+            snapshot = await self.graph.aget_state(config)
+            if resume and snapshot.values:
+                yield {"event": "resumed", "next": list(snapshot.next), "elapsed": time.monotonic() - start_time}
+                if not snapshot.next:
+                    yield {"event": "done", "state": snapshot.values, "elapsed": time.monotonic() - start_time}
+                    return
+                # Continue from the last checkpoint instead of starting over
+                inputs = None
+                state = snapshot.values
+            elif snapshot.values:
+                await self.discard_checkpoint(index)
+        async for mode, chunk in self.graph.astream(inputs, config,
+                                                    stream_mode=["custom", "updates", "values"]):
+            if mode == "values":
+                state = chunk
+                continue
+            if mode == "custom":
+                yield {**chunk, "elapsed": time.monotonic() - start_time}
+                continue
+            for node, update in chunk.items():
+                for event in _update_events(node, update or {}):
+                    yield {**event, "elapsed": time.monotonic() - start_time}
+                yield {"event": "node_finished", "node": node, "elapsed": time.monotonic() - start_time}
+        yield {"event": "done", "state": state, "elapsed": time.monotonic() - start_time}
+
+    async def arun(self, index, problem_statement, name, on_event=None, resume=False, workspace=None,
+                   fail_tests=None):
+        """
+        Runs the agent system on a task and returns the final state (planner_result, coder_result,
+        tester_result, ...).
+        If given, on_event is called with every event of astream except the final one.
+        """
+        state = {}
+        async for event in self.astream(index, problem_statement, name, resume, workspace, fail_tests):
+            if event["event"] == "done":
+                state = event["state"]
+            elif on_event is not None:
+                on_event(event)
+        return state
+
+    async def aclose(self):
+        await self.http_async_client.aclose()
+        self.http_client.close()
+
+
+def _seed_calls(planner_messages, plan):
+    """
+    Returns the get_file_content calls of the planner that read files mentioned in its plan, as
+    calls for the coder, without duplicates and up to CODER_SEED_TOKEN_BUDGET estimated tokens
+    of results.
+    """
+    results = {message.tool_call_id: message for message in planner_messages if isinstance(message, ToolMessage)}
+    seed_calls = []
+    seen = set()
+    tokens = 0
+    for message in planner_messages:
+        if not isinstance(message, AIMessage):
+            continue
+        for call in message.tool_calls:
+            args = call["args"]
+            file_path = args.get("file_path")
+            result = results.get(call["id"])
+            if (call["name"] != "get_file_content" or not file_path or args.get("outline") or result is None
+                    or result.status == "error" or str(result.content).startswith("Error")):
+                continue
+            key = json.dumps(args, sort_keys=True, default=str)
+            if key in seen or os.path.normpath(str(file_path).lstrip("/")) not in plan:
+                continue
+            result_tokens = len(str(result.content)) // CHARS_PER_TOKEN
+            if tokens + result_tokens > CODER_SEED_TOKEN_BUDGET:
+                continue
+            seen.add(key)
+            tokens += result_tokens
+            seed_calls.append({"name": "get_file_content", "args": args, "id": f"seed_{len(seed_calls)}",
+                               "type": "tool_call"})
+    return seed_calls
+
+
+def _cached_tokens(usage):
+    """
+    Returns the input tokens of a response's usage metadata that were read from the prompt cache.
+    """
+    return (usage.get("input_token_details") or {}).get("cache_read", 0)
+
+
+def _update_events(node, update):
+    """
+    Derives llm_response, tool_called and tool_result events from the state update of a node.
+    """
+    agent = "planner" if "planner" in node else "coder"
+    for message in update.get(f"{agent}_messages", []):
+        if isinstance(message, AIMessage):
+            usage = message.usage_metadata or {}
+            yield {"event": "llm_response", "agent": agent,
+                   "input_tokens": usage.get("input_tokens", 0), "output_tokens": usage.get("output_tokens", 0),
+                   "cached_tokens": _cached_tokens(usage),
+                   "compaction_saved_tokens": message.response_metadata.get("compaction_saved_tokens", 0),
+                   "tool_calls": len(message.tool_calls)}
+            for call in message.tool_calls:
+                yield {"event": "tool_called", "agent": agent, "tool": call["name"], "args": call["args"]}
+        elif isinstance(message, ToolMessage):
+            yield {"event": "tool_result", "agent": agent, "tool": message.name, "status": message.status,
+                   "characters": len(str(message.content))}
+
+
+def run_agents(index, problem_statement, name, url, key, llm_cache=None):
+    """
+    Runs the agent system synchronously on a single task and returns the final state.
+    """
+    return asyncio.run(arun_agents(index, problem_statement, name, url, key, llm_cache))
+
+
+async def arun_agents(index, problem_statement, name, url, key, llm_cache=None, on_event=None):
+    """
+    Runs the agent system on a single task with a runtime of its own, see AgentRuntime.arun.
+    Use one AgentRuntime directly to run many tasks.
+    """
+    runtime = AgentRuntime(url, key, llm_cache)
+    try:
+        return await runtime.arun(index, problem_statement, name, on_event)
+    finally:
+        await runtime.aclose()
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+TASK_PATTERN = re.compile(r"Fix (func_\d+_(\d+)) in (\S+):")
+
+
+class _Server:
+    """
+    HTTP server on a free local port, serving from a background thread.
+    """
+
+    def __init__(self, handler):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeTaskServer(_Server):
+    """
+    Stand-in for the task API: GET /task/index/<index> returns tasks[index].
+    """
+
+    def __init__(self, tasks):
+        class Handler(_QuietHandler):
+            def do_GET(self):
+                match = re.fullmatch(r"/task/index/(\d+)", self.path)
+                if match is None or int(match.group(1)) not in tasks:
+                    self._send_json(404, {"error": "not found"})
+                    return
+                self._send_json(200, tasks[int(match.group(1))])
+
+        super().__init__(Handler)
+
+    @property
+    def api_url(self):
+        return f"{self.url}/task/index/"
+
+
+class FakeHarness(_Server):
+    """
+    Stand-in for the SWE-Bench harness: POST /test reports FAIL_TO_PASS as passed if the
+    checkout contains the expected fix, and PASS_TO_PASS as passed always. The /repos prefix of
+    repoDir is mapped to repos_root. latency simulates the time of a test run.
+    """
+
+    def __init__(self, fixes, repos_root, latency=0.0):
+        class Handler(_QuietHandler):
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                time.sleep(latency)
+                repo_dir = os.path.join(repos_root, request["repoDir"].removeprefix("/repos/"))
+                relative_path, expected = fixes[request["instance_id"]]
+                try:
+                    with open(os.path.join(repo_dir, relative_path), "r", encoding="utf-8") as file:
+                        fixed = expected in file.read()
+                except OSError:
+                    fixed = False
+                fail_to_pass = request["FAIL_TO_PASS"]
+                status = {
+                    "FAIL_TO_PASS": {"success": fail_to_pass if fixed else [], "failure": [] if fixed else fail_to_pass},
+                    "PASS_TO_PASS": {"success": request["PASS_TO_PASS"], "failure": []},
+                }
+                output = {request["instance_id"]: {"tests_status": status}}
+                self._send_json(200, {"harnessOutput": json.dumps(output)})
+
+        super().__init__(Handler)
+
+    @property
+    def test_url(self):
+        return f"{self.url}/test"
+
+
+class ScriptedChatModel:
+    """
+    Stand-in for the chat model that plays a fixed, deterministic sequence of turns for the
+    synthetic tasks: the planner searches, outlines and reads the target module, the coder reads
+    it and fixes it with apply_edits. The turn is derived from the messages alone, so one model
+    serves any number of concurrent tasks. latency simulates the response time of the endpoint.
+    """
+
+    def __init__(self, latency=0.0, output_tokens=50):
+        self.latency = latency
+        self.output_tokens = output_tokens
+        self.calls = 0
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _turns(self, messages):
+        prompt = "\n".join(str(message.content) for message in messages[:2])
+        match = TASK_PATTERN.search(prompt)
+        if match is None:
+            return [("", [])]
+        name, number, path = match.group(1), match.group(2), match.group(3)
+        if "You are the Planner" in prompt:
+            return [
+                ("", [("search_repository", {"query": name, "kind": "symbol"}),
+                      ("list_files_in_repository", {"subdirectory": os.path.dirname(path), "pattern": "*.py"})]),
+                ("", [("get_file_content", {"file_path": path, "outline": True}),
+                      ("search_repository", {"query": f"def {name}(", "kind": "text"})]),
+                ("", [("get_file_content", {"file_path": path, "start_line": 1, "end_line": 60})]),
+                (f"1. In {path}, change the result line of {name} to value * {number} + 1.", []),
+            ]
+        return [
+            ("", [("get_file_content", {"file_path": path, "start_line": 1, "end_line": 60})]),
+            ("", [("apply_edits", {"edits": [{"file_path": path, "op": "replace",
+                                              "old": f"result = value * {number}  # {name}",
+                                              "new": f"result = value * {number} + 1  # {name}"}]})]),
+            ("Done.", []),
+        ]
+
+    def _respond(self, messages):
+        self.calls += 1
+        turns = self._turns(messages)
+        turn = sum(1 for message in messages if isinstance(message, (AIMessage, AIMessageChunk)))
+        content, calls = turns[min(turn, len(turns) - 1)]
+        characters = sum(len(str(message.content)) for message in messages)
+        return AIMessage(
+            content=content,
+            tool_calls=[{"name": name, "args": args, "id": f"call_{turn}_{position}", "type": "tool_call"}
+                        for position, (name, args) in enumerate(calls)],
+            usage_metadata={"input_tokens": characters // 4, "output_tokens": self.output_tokens,
+                            "total_tokens": characters // 4 + self.output_tokens},
+        )
+
+    def invoke(self, messages, config=None):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._respond(messages)
+
+    async def ainvoke(self, messages, config=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._respond(messages)
@@ -0,0 +1,307 @@
+"""
+Offline benchmarks of the orchestration layer, run against local stand-ins for the task API,
+the harness and the model, on synthetic repositories:
+
+- tools: latency of the repository tools on a large synthetic repository
+- graph: overhead of the agent graph per LLM turn with a zero-latency scripted model
+- e2e: throughput of main.run_batch at several concurrency levels, with checkpointing as in main
+
+    python -m bench.run [--quick] [--only tools,graph,e2e] [--check]
+
+Every result is appended to bench/results.jsonl and compared with the median of the last
+recorded results of the same benchmark and parameters on this host; --check exits with status 1
+if any got worse by more than the threshold.
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from bench.fakes import FakeHarness, FakeTaskServer, ScriptedChatModel
+from bench.synthetic import make_synthetic_repo, make_task, module_path
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_FILE = os.path.join(BENCH_DIR, "results.jsonl")
+# Relative change against the recorded baseline that counts as a regression
+REGRESSION_THRESHOLD = 0.25
+# Recorded results the baseline is the median of
+BASELINE_RUNS = 5
+
+
+@contextlib.contextmanager
+def _quiet(enabled=True):
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def _result(benchmark, metric, value, better, **params):
+    return {"benchmark": benchmark, "metric": metric, "value": round(value, 3), "better": better,
+            "params": params}
+
+
+def _timed_calls(function, repeats):
+    durations = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start_time)
+    return durations
+
+
+def bench_tools(repo_path, files, repeats, quiet=True):
+    # Imported here, so REPOS_ROOT is set up before the repository modules read it
+    from search_index import drop_search_index, get_search_index
+    from tools import apply_edits, get_file_content, list_files_in_repository, search_repository
+    from workspace import Workspace
+
+    config = {"configurable": {"workspace": Workspace(repo_path)}}
+    results = []
+    with _quiet(quiet):
+        drop_search_index(repo_path)
+        start_time = time.perf_counter()
+        get_search_index(repo_path)
+        results.append(_result("tools", "search_index_build_s", time.perf_counter() - start_time, "lower",
+                               files=files))
+
+        target = module_path(files // 2)
+        cases = {
+            "list_files": (list_files_in_repository, {}),
+            "list_files_filtered": (list_files_in_repository, {"subdirectory": "pkg_03", "pattern": "*.py"}),
+            "search_symbol": (search_repository, {"query": f"func_{files // 2}_3", "kind": "symbol"}),
+            "search_text": (search_repository, {"query": f"value * 7  # func_{files // 2}_7"}),
+            "read_full": (get_file_content, {"file_path": target}),
+            "read_range": (get_file_content, {"file_path": target, "start_line": 40, "end_line": 80}),
+            "read_outline": (get_file_content, {"file_path": target, "outline": True}),
+        }
+        for name, (tool, args) in cases.items():
+            durations = _timed_calls(lambda: tool.invoke(args, config), repeats)
+            results.append(_result("tools", f"{name}_p50_ms", statistics.median(durations) * 1000, "lower",
+                                   files=files))
+
+        edits = [
+            [{"file_path": target, "op": "replace", "old": f"value * 5  # func_{files // 2}_5",
+              "new": f"value * 5 + 1  # func_{files // 2}_5"}],
+            [{"file_path": target, "op": "replace", "old": f"value * 5 + 1  # func_{files // 2}_5",
+              "new": f"value * 5  # func_{files // 2}_5"}],
+        ]
+        durations = []
+        for repeat in range(repeats):
+            start_time = time.perf_counter()
+            apply_edits.invoke({"edits": edits[repeat % 2]}, config)
+            durations.append(time.perf_counter() - start_time)
+        if repeats % 2:
+            apply_edits.invoke({"edits": edits[1]}, config)
+        results.append(_result("tools", "apply_edits_p50_ms", statistics.median(durations) * 1000, "lower",
+                               files=files))
+        drop_search_index(repo_path)
+    return results
+
+
+def bench_graph(repo_path, commit, files, runs, quiet=True):
+    from agents import AgentRuntime
+    from search_index import drop_search_index, get_search_index
+    from workspace import Workspace
+
+    checkout = os.path.join(os.path.dirname(repo_path), "graph", os.path.basename(repo_path))
+    if not os.path.exists(checkout):
+        subprocess.run(["git", "clone", "--quiet", "--shared", repo_path, checkout], check=True)
+    subprocess.run(["git", "checkout", "--quiet", "--force", "--detach", commit], cwd=checkout, check=True)
+    task, _ = make_task(1, repo_path, commit, files)
+    llm = ScriptedChatModel()
+
+    async def run():
+        runtime = AgentRuntime(url=None, key="bench", llm=llm)
+        durations = []
+        try:
+            for _ in range(runs):
+                subprocess.run(["git", "checkout", "--quiet", "--", "."], cwd=checkout, check=True)
+                start_time = time.perf_counter()
+                await runtime.arun(1, task["Problem_statement"], os.path.basename(checkout),
+                                   workspace=Workspace(checkout))
+                durations.append(time.perf_counter() - start_time)
+        finally:
+            await runtime.aclose()
+        return durations
+
+    with _quiet(quiet):
+        get_search_index(checkout)
+        llm.calls = 0
+        durations = asyncio.run(run())
+        drop_search_index(checkout)
+    turns = llm.calls / runs
+    return [
+        _result("graph", "task_p50_s", statistics.median(durations), "lower", files=files),
+        _result("graph", "turn_overhead_ms", statistics.median(durations) / turns * 1000, "lower", files=files),
+    ]
+
+
+def bench_end_to_end(repo_path, commit, files, tasks, levels, llm_latency, harness_latency, repos_root,
+                     quiet=True):
+    import main as runner
+    from results_store import ResultsStore
+
+    cases = {index: make_task(index, repo_path, commit, files) for index in range(1, tasks + 1)}
+    # Checkpointing is on by default in main, so the batches run with it as well
+    checkpoints = os.path.join(os.path.dirname(repos_root), "e2e-checkpoints.sqlite")
+
+    async def run_batch(indices, *workers, **kwargs):
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+        async with AsyncSqliteSaver.from_conn_string(checkpoints) as checkpointer:
+            await checkpointer.setup()
+            return await runner.run_batch(indices, *workers, checkpointer=checkpointer, **kwargs)
+
+    fixes = {task["instance_id"]: fix for task, fix in cases.values()}
+    results = []
+    with FakeTaskServer({index: task for index, (task, _) in cases.items()}) as api, \
+            FakeHarness(fixes, repos_root, harness_latency) as harness:
+        runner.API_URL = api.api_url
+        runner.HARNESS_URL = harness.test_url
+        store = ResultsStore(os.path.join(os.path.dirname(repos_root), "e2e-results.jsonl"))
+        llm = ScriptedChatModel(latency=llm_latency)
+        with _quiet(quiet):
+            # Warm-up: creates the mirror of the synthetic repository outside the measurement
+            asyncio.run(run_batch([1], report_interval=None, results_store=store, llm=llm))
+        for level in levels:
+            with _quiet(quiet):
+                start_time = time.perf_counter()
+                outcomes = asyncio.run(run_batch(list(cases), level, level, level, report_interval=None,
+                                                        results_store=store, llm=llm))
+                elapsed = time.perf_counter() - start_time
+            params = {"files": files, "tasks": tasks, "concurrency": level, "llm_latency": llm_latency,
+                      "harness_latency": harness_latency}
+            results.append(_result("e2e", "throughput_tasks_per_hour", len(cases) / elapsed * 3600, "higher",
+                                   **params))
+            results.append(_result("e2e", "pass_rate", sum(1 for outcome in outcomes if outcome) / len(cases),
+                                   "higher", **params))
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, history, threshold=REGRESSION_THRESHOLD):
+    """
+    Adds the baseline, the relative change and a regression flag to every result, comparing it
+    with the median of the last recorded values of the same benchmark, metric and parameters.
+    """
+    host = platform.node()
+    for result in results:
+        key = (result["benchmark"], result["metric"], json.dumps(result["params"], sort_keys=True))
+        values = [record["value"] for record in history
+                  if record.get("host") == host and
+                  (record.get("benchmark"), record.get("metric"), json.dumps(record.get("params"), sort_keys=True)) == key]
+        values = values[-BASELINE_RUNS:]
+        result["baseline"] = statistics.median(values) if values else None
+        result["change"] = None
+        result["regression"] = False
+        if result["baseline"]:
+            change = (result["value"] - result["baseline"]) / result["baseline"]
+            result["change"] = round(change, 3)
+            result["regression"] = change > threshold if result["better"] == "lower" else change < -threshold
+    return results
+
+
+def print_results(results):
+    print(f"{'benchmark':<8} {'metric':<28} {'params':<42} {'value':>10} {'baseline':>10} {'change':>8}")
+    for result in results:
+        params = ",".join(f"{name}={value}" for name, value in result["params"].items())
+        baseline = "-" if result["baseline"] is None else f"{result['baseline']:g}"
+        change = "-" if result["change"] is None else f"{result['change'] * 100:+.0f}%"
+        flag = "  REGRESSION" if result["regression"] else ""
+        print(f"{result['benchmark']:<8} {result['metric']:<28} {params[:42]:<42} {result['value']:>10g} "
+              f"{baseline:>10} {change:>8}{flag}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the agent orchestration layer.")
+    parser.add_argument("--quick", action="store_true", help="Small repository and few tasks, for a smoke test")
+    parser.add_argument("--only", default="tools,graph,e2e", help="Comma-separated benchmarks to run")
+    parser.add_argument("--files", type=int, help="Python files in the synthetic repository (default: 2000)")
+    parser.add_argument("--repeats", type=int, default=20, help="Calls per tool benchmark (default: 20)")
+    parser.add_argument("--graph-runs", type=int, default=5, help="Agent runs of the graph benchmark (default: 5)")
+    parser.add_argument("--tasks", type=int, help="Tasks of the end-to-end benchmark (default: 16)")
+    parser.add_argument("--concurrency", help="Concurrency levels of the end-to-end benchmark (default: 1,4,16)")
+    parser.add_argument("--llm-latency", type=float, help="Simulated seconds per LLM call (default: 0.5)")
+    parser.add_argument("--harness-latency", type=float, help="Simulated seconds per test run (default: 0.5)")
+    parser.add_argument("--work-dir", help="Directory for the synthetic repository and checkouts, kept for "
+                                           "later runs (default: a temporary directory)")
+    parser.add_argument("--results", default=RESULTS_FILE, help="File the results are recorded in")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Relative change that counts as a regression (default: %(default)s)")
+    parser.add_argument("--check", action="store_true", help="Exit with status 1 on regressions")
+    parser.add_argument("--no-record", action="store_true", help="Do not record the results")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the code under test")
+    args = parser.parse_args(argv)
+    args.files = args.files or (200 if args.quick else 2000)
+    args.tasks = args.tasks or (4 if args.quick else 16)
+    args.concurrency = [int(level) for level in (args.concurrency or ("1,4" if args.quick else "1,4,16")).split(",")]
+    args.llm_latency = args.llm_latency if args.llm_latency is not None else (0.05 if args.quick else 0.5)
+    args.harness_latency = args.harness_latency if args.harness_latency is not None else (0.05 if args.quick else 0.5)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    benchmarks = {name.strip() for name in args.only.split(",") if name.strip()}
+    work_dir = os.path.abspath(args.work_dir or tempfile.mkdtemp(prefix="swebench-bench-"))
+    repos_root = os.path.join(work_dir, "repos")
+    os.makedirs(repos_root, exist_ok=True)
+    # Checkouts of the end-to-end benchmark go to the work directory, not to the real repositories
+    os.environ["REPOS_ROOT"] = repos_root
+    quiet = not args.verbose
+    try:
+        repo_path = os.path.join(work_dir, "source", f"synthetic-{args.files}")
+        print(f"Preparing synthetic repository with {args.files} files in {repo_path}...")
+        commit = make_synthetic_repo(repo_path, args.files)
+        results = []
+        if "tools" in benchmarks:
+            print("Running tool benchmark...")
+            results += bench_tools(repo_path, args.files, args.repeats, quiet)
+        if "graph" in benchmarks:
+            print("Running graph benchmark...")
+            results += bench_graph(repo_path, commit, args.files, args.graph_runs, quiet)
+        if "e2e" in benchmarks:
+            print("Running end-to-end benchmark...")
+            results += bench_end_to_end(repo_path, commit, args.files, args.tasks, args.concurrency,
+                                        args.llm_latency, args.harness_latency, repos_root, quiet)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    from results_store import ResultsStore
+    store = ResultsStore(args.results)
+    compare(results, store.read(), args.threshold)
+    print_results(results)
+    if not args.no_record:
+        run_id = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ-") + uuid.uuid4().hex[:6]
+        common = {"run_id": run_id, "recorded_at": datetime.datetime.utcnow().isoformat() + "Z",
+                  "git_commit": _git_commit(), "host": platform.node(), "python": platform.python_version()}
+        for result in results:
+            store.write({**common, **result})
+        print(f"Results recorded in {args.results} as run {run_id}.")
+    regressions = [result for result in results if result["regression"]]
+    if regressions:
+        print(f"{len(regressions)} regression(s) above {args.threshold * 100:.0f}%.")
+    return 1 if args.check and regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+import os
+import subprocess
+
+GIT_IDENTITY = ["-c", "user.name=bench", "-c", "user.email=bench@localhost"]
+
+
+def module_path(file_number, packages=20):
+    return f"pkg_{file_number % packages:02d}/module_{file_number:05d}.py"
+
+
+def function_name(file_number, function_number):
+    return f"func_{file_number}_{function_number}"
+
+
+def _module_source(file_number, functions, lines_per_function):
+    lines = [f'"""Synthetic module {file_number}."""', "import os", ""]
+    for function_number in range(functions):
+        if function_number % 5 == 0:
+            lines += ["", f"class Handler{file_number}_{function_number}:", "    name = 'handler'", ""]
+        name = function_name(file_number, function_number)
+        lines += ["", f"def {name}(value):", f'    """Computes result {function_number} of module {file_number}."""']
+        for line_number in range(lines_per_function - 3):
+            lines.append(f"    value_{line_number} = value + {line_number}  # padding")
+        lines += [f"    result = value * {function_number}  # {name}", "    return result", ""]
+    return "\n".join(lines) + "\n"
+
+
+def make_synthetic_repo(path, files=2000, functions_per_file=20, lines_per_function=8):
+    """
+    Creates a git repository with files Python modules spread over 20 packages and returns the
+    commit. Every function func_<file>_<n> computes value * n on a line tagged with its name,
+    which benchmark tasks ask the agents to change.
+    """
+    if os.path.exists(os.path.join(path, ".git")):
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=path, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    os.makedirs(path, exist_ok=True)
+    for file_number in range(files):
+        relative_path = module_path(file_number)
+        os.makedirs(os.path.join(path, os.path.dirname(relative_path)), exist_ok=True)
+        with open(os.path.join(path, relative_path), "w", encoding="utf-8") as file:
+            file.write(_module_source(file_number, functions_per_file, lines_per_function))
+    with open(os.path.join(path, "README.md"), "w", encoding="utf-8") as file:
+        file.write("# Synthetic benchmark repository\n")
+    subprocess.run(["git", "init", "--quiet"], cwd=path, check=True)
+    subprocess.run(["git", "add", "--all"], cwd=path, check=True)
+    subprocess.run(["git", *GIT_IDENTITY, "commit", "--quiet", "-m", "Synthetic repository"], cwd=path, check=True)
+    return subprocess.run(["git", "rev-parse", "HEAD"], cwd=path, check=True,
+                          capture_output=True, text=True).stdout.strip()
+
+
+def make_task(index, repo_path, commit, files, functions_per_file=20):
+    """
+    Returns a task in the format of the task API and the fix the harness checks for.
+    """
+    file_number = (index * 7919) % files
+    function_number = index % functions_per_file
+    name = function_name(file_number, function_number)
+    relative_path = module_path(file_number)
+    repo_name = os.path.basename(repo_path)
+    task = {
+        "instance_id": f"synthetic__{index}",
+        "Problem_statement": f"Fix {name} in {relative_path}: it must return value * {function_number} + 1 "
+                             f"instead of value * {function_number}.",
+        "git_clone": f"git clone {repo_path} && cd {repo_name} && git checkout {commit}",
+        "FAIL_TO_PASS": f'["tests/test_{name}.py::test_{name}"]',
+        "PASS_TO_PASS": f'["tests/test_{name}.py::test_{name}_unchanged"]',
+    }
+    fix = (relative_path, f"result = value * {function_number} + 1  # {name}")
+    return task, fix
@@ -0,0 +1,155 @@
+import json
+from langchain_core.messages import AIMessage, ToolMessage
+from tools import READ_ONLY_TOOLS, WRITE_TOOLS
+
+# Rough characters per token of source code and English text for OpenAI tokenizers
+CHARS_PER_TOKEN = 4
+DEFAULT_TOKEN_BUDGET = 60000
+# Characters kept from the start and the end of a tool result that is elided for the budget
+ELIDED_EXCERPT_CHARS = 400
+# Steps in which the context is cut down once it exceeds the budget, so the compacted messages,
+# and with them the prompt prefix cached by the provider, only change every few turns
+COMPACTION_STEP_TOKENS = 8000
+
+RANGE_ARGS = ("start_line", "end_line", "start_byte", "end_byte", "outline")
+
+
+def estimate_tokens(messages):
+    """
+    Estimates the prompt tokens of a message list from its length.
+    """
+    characters = 0
+    for message in messages:
+        content = message.content
+        characters += len(content) if isinstance(content, str) else len(json.dumps(content, default=str))
+        for call in getattr(message, "tool_calls", None) or ():
+            characters += len(call["name"]) + len(json.dumps(call["args"], default=str))
+    return characters // CHARS_PER_TOKEN
+
+
+def read_key(call):
+    """
+    Identifies what a read tool call looked at, ignoring the repository argument.
+    """
+    args = {name: value for name, value in call["args"].items() if name not in ("repo", "repository_name")}
+    return call["name"], json.dumps(args, sort_keys=True, default=str)
+
+
+def _written_paths(call):
+    """
+    Returns the files a write tool call changed.
+    """
+    if call["name"] == "apply_edits":
+        return {edit.get("file_path") for edit in call["args"].get("edits", []) if isinstance(edit, dict)}
+    return {call["args"].get("file_path")}
+
+
+def repeated_calls(messages):
+    """
+    Maps the ids of read tool calls that repeat an earlier read with the same arguments, with no
+    write tool call in between, to the id of the first of these calls.
+    """
+    first_calls = {}
+    repeats = {}
+    for message in messages:
+        if not isinstance(message, AIMessage):
+            continue
+        for call in message.tool_calls:
+            if call["name"] in WRITE_TOOLS:
+                # Any write may change what a read returns
+                first_calls.clear()
+            elif call["name"] in READ_ONLY_TOOLS:
+                key = read_key(call)
+                if key in first_calls:
+                    repeats[call["id"]] = first_calls[key]
+                else:
+                    first_calls[key] = call["id"]
+    return repeats
+
+
+def _elide(content, reason):
+    if len(content) <= 2 * ELIDED_EXCERPT_CHARS:
+        return content
+    elided = len(content) - 2 * ELIDED_EXCERPT_CHARS
+    return (f"{content[:ELIDED_EXCERPT_CHARS]}\n[... {elided} characters elided {reason}; "
+            f"call the tool again if you need them ...]\n{content[-ELIDED_EXCERPT_CHARS:]}")
+
+
+def compact_messages(messages, token_budget=DEFAULT_TOKEN_BUDGET):
+    """
+    Returns a compacted copy of messages for the next LLM call, and the estimated tokens before
+    and after compaction. The messages in the state are not modified.
+
+    Within token_budget, the messages are returned unchanged: the previous request is then a
+    prefix of the next one, which the provider serves from its prompt cache. Above it, the
+    estimate is reduced by a multiple of COMPACTION_STEP_TOKENS:
+
+    - Results of read tools that were repeated later with the same arguments, file reads followed
+      by a later read of the whole file and file reads followed by a write to that file are
+      replaced by a short note, since they no longer show the current content.
+    - If that is not enough, the oldest tool results are cut down to an excerpt until it is.
+
+    The messages before the first LLM response (system prompt and task) and the results of the
+    latest turn are never changed. Tool messages are shortened rather than dropped, so every
+    tool call keeps its result.
+    """
+    tokens_before = estimate_tokens(messages)
+    if tokens_before <= token_budget:
+        return list(messages), tokens_before, tokens_before
+    steps = -(-(tokens_before - token_budget) // COMPACTION_STEP_TOKENS)
+    target_tokens = tokens_before - steps * COMPACTION_STEP_TOKENS
+
+    calls = {}
+    for message in messages:
+        if isinstance(message, AIMessage):
+            for call in message.tool_calls:
+                calls[call["id"]] = call
+
+    ai_positions = [position for position, message in enumerate(messages) if isinstance(message, AIMessage)]
+    first_ai_position = ai_positions[0] if ai_positions else len(messages)
+    last_ai_position = ai_positions[-1] if ai_positions else len(messages)
+    protected = set(range(first_ai_position)) | set(range(last_ai_position, len(messages)))
+
+    compacted = list(messages)
+    later_reads = set()
+    later_full_reads = set()
+    later_writes = set()
+    for position in range(len(compacted) - 1, -1, -1):
+        message = compacted[position]
+        if isinstance(message, AIMessage):
+            for call in message.tool_calls:
+                if call["name"] in WRITE_TOOLS:
+                    later_writes.update(_written_paths(call))
+            continue
+        if not isinstance(message, ToolMessage) or message.tool_call_id not in calls:
+            continue
+        call = calls[message.tool_call_id]
+        if call["name"] not in READ_ONLY_TOOLS:
+            continue
+        key = read_key(call)
+        file_path = call["args"].get("file_path") if call["name"] == "get_file_content" else None
+        note = None
+        if key in later_reads:
+            note = f"[Superseded: {call['name']} was called again with the same arguments later on.]"
+        elif file_path and file_path in later_full_reads:
+            note = f"[Superseded: {file_path} was read again in full later on.]"
+        elif file_path and file_path in later_writes:
+            note = f"[Stale: {file_path} was modified after this read, read it again if needed.]"
+        if note is not None and position not in protected:
+            compacted[position] = message.model_copy(update={"content": note})
+        later_reads.add(key)
+        if file_path and not any(call["args"].get(name) for name in RANGE_ARGS):
+            later_full_reads.add(file_path)
+
+    tokens = estimate_tokens(compacted)
+    for position, message in enumerate(compacted):
+        if tokens <= target_tokens:
+            break
+        if position in protected or not isinstance(message, ToolMessage) or not isinstance(message.content, str):
+            continue
+        content = _elide(message.content, "to stay within the context budget")
+        if content != message.content:
+            tokens -= (len(message.content) - len(content)) // CHARS_PER_TOKEN
+            compacted[position] = message.model_copy(update={"content": content})
+
+    return compacted, tokens_before, estimate_tokens(compacted)
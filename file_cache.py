@@ -0,0 +1,121 @@
+import ast
+import os
+import threading
+from array import array
+from collections import OrderedDict
+
+# Upper bound for the bytes kept in the cache before least recently used files are dropped
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class CachedFile:
+    """
+    The content of a file together with an index of its line offsets, so that line and byte
+    ranges can be sliced out without reading or scanning the whole file again.
+    """
+
+    def __init__(self, path, data, mtime_ns, size, inode=None):
+        self.path = path
+        self.data = data
+        self.inode = inode
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self._line_offsets = None
+
+    @property
+    def line_offsets(self):
+        if self._line_offsets is None:
+            offsets = array("Q", [0])
+            position = self.data.find(b"\n")
+            while position != -1:
+                offsets.append(position + 1)
+                position = self.data.find(b"\n", position + 1)
+            if offsets[-1] == len(self.data) and len(offsets) > 1:
+                offsets.pop()
+            self._line_offsets = offsets
+        return self._line_offsets
+
+    @property
+    def line_count(self):
+        return len(self.line_offsets) if self.data else 0
+
+    def text(self):
+        return self.data.decode("utf-8", errors="replace")
+
+    def lines(self, start_line, end_line=None):
+        """
+        Returns lines start_line to end_line (1-based, inclusive) as text.
+        """
+        offsets = self.line_offsets
+        end_line = self.line_count if end_line is None else min(end_line, self.line_count)
+        start = offsets[start_line - 1]
+        end = offsets[end_line] if end_line < len(offsets) else len(self.data)
+        return self.data[start:end].decode("utf-8", errors="replace")
+
+    def byte_range(self, start_byte, end_byte=None):
+        return self.data[start_byte:end_byte].decode("utf-8", errors="replace")
+
+    def outline(self):
+        """
+        Returns the classes and functions of a Python file with their line ranges.
+        """
+        tree = ast.parse(self.data, filename=self.path)
+        entries = []
+
+        def visit(nodes, depth):
+            for node in nodes:
+                if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+                    kind = "class" if isinstance(node, ast.ClassDef) else "def"
+                    entries.append(f"{'    ' * depth}{kind} {node.name}: lines {node.lineno}-{node.end_lineno}")
+                    if isinstance(node, ast.ClassDef):
+                        visit(node.body, depth + 1)
+
+        visit(tree.body, 0)
+        return "\n".join(entries)
+
+
+_cache = OrderedDict()
+_cache_bytes = 0
+_lock = threading.Lock()
+
+
+def get_cached_file(path):
+    """
+    Returns the CachedFile for path, reading it from disk only if it is not cached yet or
+    changed on disk since it was cached.
+    """
+    global _cache_bytes
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    with _lock:
+        cached = _cache.get(path)
+        # Atomic writes replace the file, so the inode tells them apart within one mtime tick
+        if (cached is not None and cached.inode == stat.st_ino and cached.mtime_ns == stat.st_mtime_ns
+                and cached.size == stat.st_size):
+            _cache.move_to_end(path)
+            return cached
+
+    with open(path, "rb") as file:
+        data = file.read()
+    cached = CachedFile(path, data, stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    with _lock:
+        previous = _cache.pop(path, None)
+        if previous is not None:
+            _cache_bytes -= len(previous.data)
+        _cache[path] = cached
+        _cache_bytes += len(data)
+        while _cache_bytes > MAX_CACHE_BYTES and len(_cache) > 1:
+            _, evicted = _cache.popitem(last=False)
+            _cache_bytes -= len(evicted.data)
+    return cached
+
+
+def invalidate_cached_file(path):
+    """
+    Drops path from the cache. Write tools call this after changing a file.
+    """
+    global _cache_bytes
+    with _lock:
+        cached = _cache.pop(os.path.abspath(path), None)
+        if cached is not None:
+            _cache_bytes -= len(cached.data)
@@ -0,0 +1,183 @@
+import ast
+import difflib
+import os
+import tempfile
+from file_cache import get_cached_file
+
+# Lines of the unified diff returned to the agent before it is cut off
+MAX_DIFF_LINES = 200
+DIFF_CONTEXT_LINES = 2
+
+
+class EditError(ValueError):
+    pass
+
+
+def write_atomic(path, data):
+    """
+    Writes data to path through a temporary file in the same directory that is renamed over the
+    target, so an interrupted write never leaves a half-written file behind. Keeps the file mode
+    of an existing file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = 0o644
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def _line_range(lines, edit, start_key, end_key):
+    start_line = edit.get(start_key)
+    end_line = edit.get(end_key, start_line)
+    if not isinstance(start_line, int) or not isinstance(end_line, int):
+        raise EditError(f"'{start_key}' and '{end_key}' must be line numbers.")
+    if start_line < 1 or end_line > len(lines) or start_line > end_line:
+        raise EditError(f"Invalid line range {start_line}-{end_line}, the file has {len(lines)} lines.")
+    return start_line, end_line
+
+
+def _content_lines(content):
+    if isinstance(content, list):
+        content = "\n".join(line.rstrip("\n") for line in content)
+    if not isinstance(content, str):
+        raise EditError("'content' must be a string.")
+    return (content if content.endswith("\n") or not content else content + "\n").splitlines(keepends=True)
+
+
+def apply_edit(text, edit):
+    """
+    Applies a single edit to text and returns the new text. Line numbers are 1-based and
+    inclusive, and refer to the text as left by the previous edits.
+    """
+    op = edit.get("op", "replace")
+    if op == "replace":
+        old, new = edit.get("old"), edit.get("new", "")
+        if not isinstance(old, str) or not old or not isinstance(new, str):
+            raise EditError("'replace' needs a non-empty 'old' text and a 'new' text.")
+        expected = edit.get("count", 1)
+        found = text.count(old)
+        if found == 0:
+            raise EditError(f"'old' text not found: {old[:200]!r}")
+        if expected is not None and found != expected:
+            raise EditError(f"'old' text found {found} times, expected {expected}. Include more surrounding "
+                            f"lines to make it unique, or set 'count' to {found}.")
+        return text.replace(old, new)
+
+    if op == "write":
+        return "".join(_content_lines(edit.get("content", "")))
+
+    lines = text.splitlines(keepends=True)
+    if lines and not lines[-1].endswith(("\n", "\r")):
+        lines[-1] += "\n"
+    if op == "replace_lines":
+        start_line, end_line = _line_range(lines, edit, "start_line", "end_line")
+        lines[start_line - 1:end_line] = _content_lines(edit.get("content", ""))
+    elif op == "delete_lines":
+        start_line, end_line = _line_range(lines, edit, "start_line", "end_line")
+        del lines[start_line - 1:end_line]
+    elif op == "insert":
+        line = edit.get("line")
+        if not isinstance(line, int) or line < 1 or line > len(lines) + 1:
+            raise EditError(f"Invalid line {line} to insert at, the file has {len(lines)} lines.")
+        lines[line - 1:line - 1] = _content_lines(edit.get("content", ""))
+    else:
+        raise EditError(f"Unknown op '{op}', use replace, replace_lines, insert, delete_lines or write.")
+    return "".join(lines)
+
+
+def _python_error(path, text):
+    try:
+        ast.parse(text, filename=path)
+    except SyntaxError as e:
+        return f"line {e.lineno}: {e.msg}"
+    return None
+
+
+def apply_edits(repo_path, edits):
+    """
+    Applies a list of edits, each with a file_path relative to repo_path and an op, as one
+    transaction and returns (changed paths, unified diff).
+
+    All edits are applied to in-memory buffers first. Python files that parsed before must
+    still parse afterwards. Only if every edit applies and every file validates are the files
+    written, each with an atomic rename; otherwise EditError is raised and nothing changes on disk.
+    """
+    if not edits:
+        raise EditError("No edits given.")
+    originals = {}
+    buffers = {}
+    repo_root = os.path.realpath(repo_path)
+    for position, edit in enumerate(edits, start=1):
+        if not isinstance(edit, dict) or not edit.get("file_path"):
+            raise EditError(f"Edit {position}: every edit needs a 'file_path'.")
+        relative_path = os.path.normpath(edit["file_path"].lstrip("/"))
+        path = os.path.join(repo_root, relative_path)
+        if not os.path.realpath(path).startswith(repo_root + os.sep):
+            raise EditError(f"Edit {position}: '{edit['file_path']}' is outside the repository.")
+        if relative_path not in buffers:
+            try:
+                original = get_cached_file(path).data.decode("utf-8")
+            except FileNotFoundError:
+                if edit.get("op") != "write":
+                    raise EditError(f"Edit {position}: file '{relative_path}' not found, use op 'write' to create it.")
+                original = None
+            except UnicodeDecodeError:
+                raise EditError(f"Edit {position}: '{relative_path}' is not a UTF-8 text file.")
+            originals[relative_path] = original
+            buffers[relative_path] = original or ""
+        try:
+            buffers[relative_path] = apply_edit(buffers[relative_path], edit)
+        except EditError as e:
+            raise EditError(f"Edit {position} ({relative_path}): {e}")
+
+    changed = [relative_path for relative_path, text in buffers.items() if text != originals[relative_path]]
+    for relative_path in changed:
+        if not relative_path.endswith(".py"):
+            continue
+        original = originals[relative_path]
+        error = _python_error(relative_path, buffers[relative_path])
+        if error and (original is None or _python_error(relative_path, original) is None):
+            raise EditError(f"The edits leave {relative_path} with a syntax error at {error}; nothing was written.")
+
+    written = []
+    try:
+        for relative_path in changed:
+            path = os.path.join(repo_root, relative_path)
+            if originals[relative_path] is None:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_atomic(path, buffers[relative_path].encode("utf-8"))
+            written.append(relative_path)
+    except OSError:
+        # Roll back the files that were already replaced, so the transaction has no partial effect
+        for relative_path in written:
+            path = os.path.join(repo_root, relative_path)
+            if originals[relative_path] is None:
+                os.unlink(path)
+            else:
+                write_atomic(path, originals[relative_path].encode("utf-8"))
+        raise
+
+    diff = []
+    for relative_path in changed:
+        diff.extend(difflib.unified_diff(
+            (originals[relative_path] or "").splitlines(keepends=True),
+            buffers[relative_path].splitlines(keepends=True),
+            "/dev/null" if originals[relative_path] is None else f"a/{relative_path}", f"b/{relative_path}",
+            n=DIFF_CONTEXT_LINES,
+        ))
+    diff = [line if line.endswith("\n") else line + "\n" for line in diff]
+    if len(diff) > MAX_DIFF_LINES:
+        diff = diff[:MAX_DIFF_LINES] + [f"[... {len(diff) - MAX_DIFF_LINES} more diff lines ...]\n"]
+    return changed, "".join(diff)
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from langchain_core.messages import messages_from_dict, messages_to_dict
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+# Default upper bound for the size of the stored responses
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def _canonical_message(message):
+    """
+    Reduces a message to the fields the model actually sees, so that ids, timings and usage
+    metadata of earlier runs do not change the cache key.
+    """
+    canonical = {"type": message.type, "content": message.content}
+    if getattr(message, "tool_calls", None):
+        canonical["tool_calls"] = [{"name": call["name"], "args": call["args"], "id": call["id"]}
+                                   for call in message.tool_calls]
+    if getattr(message, "tool_call_id", None):
+        canonical["tool_call_id"] = message.tool_call_id
+    return canonical
+
+
+class LLMResponseCache:
+    """
+    On-disk cache of chat model responses in SQLite, keyed on the model, the bound tools and the
+    message history. Least recently used responses are evicted once the cache exceeds max_bytes.
+    Safe to share between threads.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, created REAL, last_used REAL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._connection.commit()
+
+    @staticmethod
+    def make_key(model, tool_schemas, messages):
+        payload = {
+            "model": model,
+            "tools": tool_schemas,
+            "messages": [_canonical_message(message) for message in messages],
+        }
+        encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._connection.commit()
+        return messages_from_dict([json.loads(row[0])])[0]
+
+    def put(self, key, model, message):
+        response = json.dumps(messages_to_dict([message])[0], ensure_ascii=False, default=str)
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, len(response.encode("utf-8")), now, now),
+            )
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self):
+        total = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._connection.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class CachedChatModel:
+    """
+    Wraps a chat model with bound tools and answers from the cache when the same model, tools and
+    messages were seen before.
+    """
+
+    def __init__(self, llm, cache, model, tools):
+        self.llm = llm
+        self.cache = cache
+        self.model = model
+        self.tool_schemas = [convert_to_openai_tool(bound_tool) for bound_tool in tools]
+
+    async def ainvoke(self, messages):
+        key = LLMResponseCache.make_key(self.model, self.tool_schemas, messages)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        message = await self.llm.ainvoke(messages)
+        self.cache.put(key, self.model, message)
+        return message
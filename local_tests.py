@@ -0,0 +1,107 @@
+import asyncio
+import os
+import re
+import signal
+import sys
+import time
+from metrics import span
+
+DEFAULT_TIMEOUT = 120
+# Characters of the test output fed back to the coder
+MAX_FEEDBACK_CHARS = 4000
+
+DJANGO_TEST_PATTERN = re.compile(r"(\w+) \(([\w.]+)\)")
+PYTEST_OUTCOME_PATTERN = re.compile(r"^(PASSED|FAILED|ERROR|XFAIL|XPASS|SKIPPED) (\S+)", re.MULTILINE)
+# Errors that mean the environment cannot run the tests, not that the fix is wrong
+ENVIRONMENT_ERRORS = ("ModuleNotFoundError", "ImportError while", "No module named", "command not found",
+                      "ERROR: usage:", "unrecognized arguments")
+
+
+class LocalTestRunner:
+    """
+    Runs the FAIL_TO_PASS tests of a task in its workspace, with the Python interpreter of an
+    environment that has the dependencies of the repositories installed.
+
+    run() returns a dict with the status "passed", "failed" or "inconclusive", the passed and
+    failed test ids and the tail of the output. Only "failed" is conclusive about the fix: if
+    the tests cannot be run here, time out or the output cannot be matched to the requested
+    tests, the result is "inconclusive".
+    """
+
+    def __init__(self, python=None, timeout=DEFAULT_TIMEOUT):
+        self.python = python or sys.executable
+        self.timeout = timeout
+
+    def command(self, repo_path, test_ids):
+        if all("::" in test_id or test_id.endswith(".py") for test_id in test_ids):
+            return [self.python, "-m", "pytest", "-rA", "--no-header", "-p", "no:cacheprovider", *test_ids]
+        matches = [DJANGO_TEST_PATTERN.fullmatch(test_id) for test_id in test_ids]
+        if all(matches) and os.path.exists(os.path.join(repo_path, "tests", "runtests.py")):
+            labels = [f"{match.group(2)}.{match.group(1)}" for match in matches]
+            return [self.python, "tests/runtests.py", "--verbosity", "2", "--parallel", "1", *labels]
+        return None
+
+    @staticmethod
+    def _outcomes(output, test_ids):
+        outcomes = {}
+        pytest_outcomes = {test_id: outcome for outcome, test_id in PYTEST_OUTCOME_PATTERN.findall(output)}
+        for test_id in test_ids:
+            if test_id in pytest_outcomes:
+                outcomes[test_id] = pytest_outcomes[test_id] in ("PASSED", "XFAIL")
+                continue
+            match = DJANGO_TEST_PATTERN.fullmatch(test_id)
+            if match is None:
+                continue
+            line = re.search(rf"^{re.escape(match.group(1))} \({re.escape(match.group(2))}[^)]*\)[^\n]* \.\.\. (\w+)",
+                             output, re.MULTILINE)
+            if line is not None:
+                outcomes[test_id] = line.group(1) == "ok"
+        return outcomes
+
+    async def run(self, repo_path, test_ids):
+        start_time = time.monotonic()
+        command = self.command(repo_path, test_ids) if test_ids else None
+        if command is None:
+            return {"status": "inconclusive", "passed": [], "failed": [], "duration": 0.0,
+                    "output": "The test ids are in a format that cannot be run locally."}
+        env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+        with span("local_tests"):
+            process = await asyncio.create_subprocess_exec(
+                *command, cwd=repo_path, env=env, stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT, start_new_session=True,
+            )
+            try:
+                stdout, _ = await asyncio.wait_for(process.communicate(), self.timeout)
+            except asyncio.TimeoutError:
+                # The tests may have started processes of their own
+                os.killpg(process.pid, signal.SIGKILL)
+                await process.wait()
+                return {"status": "inconclusive", "passed": [], "failed": [],
+                        "duration": time.monotonic() - start_time,
+                        "output": f"The tests did not finish within {self.timeout} seconds."}
+        output = stdout.decode("utf-8", errors="replace")
+        outcomes = self._outcomes(output, test_ids)
+        passed = [test_id for test_id in test_ids if outcomes.get(test_id) is True]
+        failed = [test_id for test_id in test_ids if outcomes.get(test_id) is False]
+        if len(passed) == len(test_ids):
+            status = "passed"
+        elif len(outcomes) == len(test_ids) and not any(error in output for error in ENVIRONMENT_ERRORS):
+            status = "failed"
+        else:
+            status = "inconclusive"
+        return {"status": status, "passed": passed, "failed": failed, "duration": time.monotonic() - start_time,
+                "output": _feedback_excerpt(output)}
+
+
+def _feedback_excerpt(output):
+    """
+    Returns the failure details of a test run, cut down to MAX_FEEDBACK_CHARS from the end.
+    """
+    for marker in ("= FAILURES =", "= ERRORS =", "\nFAIL: ", "\nERROR: "):
+        position = output.find(marker)
+        if position != -1:
+            output = output[output.rfind("\n", 0, position) + 1:]
+            break
+    if len(output) > MAX_FEEDBACK_CHARS:
+        output = "[...]\n" + output[-MAX_FEEDBACK_CHARS:]
+    return output
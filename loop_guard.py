@@ -0,0 +1,44 @@
+from langchain_core.messages import AIMessage
+from compaction import repeated_calls
+
+# Tool calls and LLM tokens (input and output) an agent may spend on one task
+AGENT_BUDGETS = {
+    "planner": {"tool_calls": 40, "tokens": 400000},
+    "coder": {"tool_calls": 60, "tokens": 600000},
+}
+# Repeated tool calls in total and consecutive turns of nothing but repeated calls before an agent is stopped
+MAX_REPEATED_CALLS = 6
+MAX_NO_PROGRESS_TURNS = 2
+
+
+def stop_reason(agent, messages):
+    """
+    Returns why an agent should stop calling tools and hand over, as a (kind, description) tuple,
+    or None while it makes progress within its budgets. Everything is derived from the messages
+    of the agent, so the check holds for resumed runs as well.
+    """
+    budget = AGENT_BUDGETS[agent]
+    responses = [message for message in messages if isinstance(message, AIMessage)]
+    tool_calls = sum(len(message.tool_calls) for message in responses)
+    if tool_calls >= budget["tool_calls"]:
+        return "tool_calls", f"used the budget of {budget['tool_calls']} tool calls"
+    tokens = sum((message.usage_metadata or {}).get("total_tokens", 0) for message in responses)
+    if tokens >= budget["tokens"]:
+        return "tokens", f"used the budget of {budget['tokens']} tokens"
+
+    repeats = repeated_calls(messages)
+    if len(repeats) >= MAX_REPEATED_CALLS:
+        return "repeats", f"repeated earlier tool calls {len(repeats)} times"
+    no_progress_turns = 0
+    for message in reversed(responses):
+        if not message.tool_calls or not all(call["id"] in repeats for call in message.tool_calls):
+            break
+        no_progress_turns += 1
+    if no_progress_turns >= MAX_NO_PROGRESS_TURNS:
+        return "no_progress", f"only repeated earlier tool calls in the last {no_progress_turns} turns"
+    return None
+
+
+def wrap_up_prompt(reason):
+    return (f"You {reason}. Do not call any more tools: write your final numbered plan for the Coder now, "
+            f"based on what you found so far.")
@@ -1,119 +1,492 @@
+import argparse
 import datetime
 import asyncio
 import json
+import time
+import uuid
 import requests
-import subprocess
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack, contextmanager
 from dotenv import load_dotenv
-from agents import run_agents
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from agents import AgentRuntime
+from llm_cache import DEFAULT_MAX_BYTES, LLMResponseCache
+from local_tests import DEFAULT_TIMEOUT, LocalTestRunner
+from metrics import Metrics, collect, span
+from pipeline import Pipeline
+from rate_limiter import RateLimiter
+from repo_cache import RepoCache
+from results_store import RESULTS_FILE, ResultsStore, print_summary, summarize
+from search_index import drop_search_index, get_search_index
+from workspace import REPOS_ROOT, Workspace
 
 load_dotenv()
 
-API_URL = "http://localhost:8081/task/index/"
-LOG_FILE = "results.log"
+API_URL = os.getenv("TASK_API_URL", "http://localhost:8081/task/index/")
+HARNESS_URL = os.getenv("HARNESS_URL", "http://localhost:8082/test")
+CHECKPOINT_DB = "checkpoints.sqlite"
 APP_NAME = "SWE-Bench-MAS-LangGraph"
 
 LITELLM_BASE_URL = os.getenv("LITELLM_BASE_URL")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Optional directory, e.g. on tmpfs, for disposable copies of the checkouts the agents work on
+SCRATCH_DIR = os.getenv("SCRATCH_DIR")
+# Python of an environment with the dependencies of the task repositories, for the local tests
+LOCAL_TEST_PYTHON = os.getenv("LOCAL_TEST_PYTHON")
+# Limits of the LLM endpoint, shared by all agents of a run
+LLM_REQUESTS_PER_MINUTE = os.getenv("LLM_REQUESTS_PER_MINUTE")
+LLM_TOKENS_PER_MINUTE = os.getenv("LLM_TOKENS_PER_MINUTE")
 
-async def handle_task(index):
-    api_url = f"{API_URL}{index}"
-    print(f"Fetching test case {index} from {api_url}...")
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    repos_base_dir = os.path.abspath(os.path.join(script_dir, '..', 'repos'))
-    repo_dir = os.path.join(repos_base_dir, f"repo_{index}")
-    start_dir = os.getcwd()
 
-    try:
-        response = requests.get(api_url)
-        if response.status_code != 200:
-            raise Exception(f"Invalid response: {response.status_code}")
-
-        testcase = response.json()
-        prompt = testcase["Problem_statement"]
-        git_clone = testcase["git_clone"]
-        fail_tests = json.loads(testcase.get("FAIL_TO_PASS", "[]"))
-        pass_tests = json.loads(testcase.get("PASS_TO_PASS", "[]"))
-        instance_id = testcase["instance_id"]
-
-        parts = git_clone.split("&&")
-        clone_part = parts[0].strip()
-        checkout_part = parts[-1].strip() if len(parts) > 1 else None
-        repo_name = parts[1].split()[1]
-
-        repo_url = clone_part.split()[2]
-
-        print(f"Cloning repository {repo_url} into {repo_dir}...")
-        env = os.environ.copy()
-        env["GIT_TERMINAL_PROMPT"] = "0"
-        if os.path.exists(os.path.join(start_dir, repo_dir)):
-            print(os.path.exists(os.path.join(start_dir, repo_dir)))
-            print("Repository was already cloned!")
+def parse_indices(spec):
+    """
+    Parses an index specification like "1-10,15,20-22" into a sorted list of unique indices.
+    """
+    indices = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            start, end = int(start), int(end)
+            if start > end:
+                raise ValueError(f"Invalid index range: {part}")
+            indices.update(range(start, end + 1))
         else:
-            subprocess.run(["git", "clone", repo_url, repo_dir], check=True, env=env)
-
-        if checkout_part:
-            commit_hash = checkout_part.split()[-1]
-            print(f"Checking out commit: {commit_hash}")
-            repo_dir_with_name = os.path.join(repo_dir, repo_name)
-            subprocess.run(["git", "checkout", commit_hash], cwd=repo_dir_with_name, check=True, env=env)
-            # Reset the working directory completely
-            subprocess.run(["git", "reset", "--hard"], cwd=repo_dir_with_name, check=True, env=env)
-            # subprocess.run(["git", "clean", "-fd"], cwd=repo_dir_with_name, check=True, env=env)
-
-        print(f"Launching Agent-System (LangGraph)...")
-
-        run_agents(index, prompt, repo_name, LITELLM_BASE_URL, OPENAI_API_KEY)
-
-        print(f"Calling SWE-Bench REST service with repo: repo_{index}/{repo_name}")
-        test_payload = {
-            "instance_id": instance_id,
-            "repoDir": f"/repos/repo_{index}/{repo_name}",
-            "FAIL_TO_PASS": fail_tests,
-            "PASS_TO_PASS": pass_tests
+            indices.add(int(part))
+    return sorted(indices)
+
+
+def _utc_now():
+    return datetime.datetime.utcnow().isoformat() + "Z"
+
+
+class Task:
+    """
+    State of a single SWE-Bench task while it moves through the pipeline stages.
+    """
+
+    def __init__(self, index, resume=False, run_id=None):
+        self.index = index
+        self.resume = resume
+        self.run_id = run_id
+        self.repo_dir = os.path.join(REPOS_ROOT, f"repo_{index}")
+        self.workspace = None
+        self.prompt = None
+        self.repo_name = None
+        self.instance_id = None
+        self.fail_tests = []
+        self.pass_tests = []
+        self.result = None
+        self.planner_result = None
+        self.coder_result = None
+        self.tester_result = None
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cached_tokens = 0
+        self.compaction_saved_tokens = 0
+        self.tool_calls = 0
+        self.fail_to_pass = None
+        self.pass_to_pass = None
+        self.timings = {}
+        self.started_at = None
+        self.error = None
+        self.error_stage = None
+        self.metrics = Metrics()
+
+    @contextmanager
+    def timed(self, stage):
+        """
+        Adds the time spent in the with block to the timing of the given stage, and collects the
+        metrics observed in it for the task.
+        """
+        if self.started_at is None:
+            self.started_at = _utc_now()
+        start_time = time.monotonic()
+        try:
+            with collect(self.metrics), span("stage", stage=stage):
+                yield
+        finally:
+            self.timings[stage] = round(self.timings.get(stage, 0.0) + time.monotonic() - start_time, 3)
+
+    def record(self):
+        """
+        Returns the record of the task for the results store.
+        """
+        if self.error is not None:
+            status = "error"
+        else:
+            status = "passed" if self.result else "failed"
+        return {
+            "run_id": self.run_id,
+            "index": self.index,
+            "instance_id": self.instance_id,
+            "status": status,
+            "all_tests_passed": self.result,
+            "FAIL_TO_PASS": self.fail_to_pass,
+            "PASS_TO_PASS": self.pass_to_pass,
+            "local_tests": self._local_tests(),
+            "timings": {**self.timings, "total": round(sum(self.timings.values()), 3)},
+            "tokens": {"input": self.input_tokens, "output": self.output_tokens, "cached": self.cached_tokens,
+                       "compaction_saved": self.compaction_saved_tokens},
+            "tool_calls": self.tool_calls,
+            "error_stage": self.error_stage,
+            "error_class": type(self.error).__name__ if self.error is not None else None,
+            "error": str(self.error) if self.error is not None else None,
+            "started_at": self.started_at,
+            "finished_at": _utc_now(),
+            "metrics": self.metrics.snapshot(buckets=False),
         }
-        res = requests.post("http://localhost:8082/test", json=test_payload)
-        res.raise_for_status()
-        result_raw = res.json().get("harnessOutput", "{}")
-        result_json = json.loads(result_raw)
-        if not result_json:
-            raise ValueError("No data in harnessOutput – possible evaluation error or empty result")
-        instance_id = next(iter(result_json))
-        tests_status = result_json[instance_id]["tests_status"]
-        fail_pass_results = tests_status["FAIL_TO_PASS"]
-        fail_pass_total = len(fail_pass_results["success"]) + len(fail_pass_results["failure"])
-        fail_pass_passed = len(fail_pass_results["success"])
-        pass_pass_results = tests_status["PASS_TO_PASS"]
-        pass_pass_total = len(pass_pass_results["success"]) + len(pass_pass_results["failure"])
-        pass_pass_passed = len(pass_pass_results["success"])
-
-        os.chdir(start_dir)
-        all_tests_passed = fail_pass_passed == fail_pass_total and pass_pass_passed == pass_pass_total
-        timestamp = datetime.datetime.utcnow().isoformat() + "Z"
-
-        with open(LOG_FILE, "a", encoding="utf-8") as log:
-            log.write(f"\n--- TESTCASE {index} ---\n")
-            log.write(f"Instance ID: {instance_id}\n")
-            log.write(f"FAIL_TO_PASS passed: {fail_pass_passed}/{fail_pass_total}\n")
-            log.write(f"PASS_TO_PASS passed: {pass_pass_passed}/{pass_pass_total}\n")
-            log.write(f"All tests passed: {str(all_tests_passed).lower()}\n")
-            log.write(f"Time: {timestamp}\n")
-        print(f"Test case {index} completed and logged.")
-
-    except Exception as e:
-        os.chdir(start_dir)
-        with open(LOG_FILE, "a", encoding="utf-8") as log:
-            log.write(f"\n--- TESTCASE {index} ---\n")
-            log.write(f"Error: {e}\n")
-        print(f"Error in test case {index}: {e}")
-
-async def main():
-    # issue_nr = 1
-    # await handle_task(issue_nr)
-
-    for issue_nr in [7]:
-        print(f"Handling task {issue_nr}...")
-        await handle_task(issue_nr)
+
+    def _local_tests(self):
+        if not self.tester_result:
+            return None
+        return {"status": self.tester_result["status"], "passed": len(self.tester_result["passed"]),
+                "total": len(self.fail_tests), "rounds": self.tester_result["rounds"]}
+
+    def on_agent_event(self, event):
+        """
+        Accumulates token usage and tool calls from the events of the agent system.
+        """
+        if event["event"] == "llm_response":
+            self.input_tokens += event["input_tokens"]
+            self.output_tokens += event["output_tokens"]
+            self.cached_tokens += event["cached_tokens"]
+            self.compaction_saved_tokens += event["compaction_saved_tokens"]
+            print(f"[task {self.index}] {event['agent']}: {event['input_tokens']} input ({event['cached_tokens']} "
+                  f"cached) / {event['output_tokens']} output tokens, {event['tool_calls']} tool call(s) "
+                  f"after {event['elapsed']:.0f}s")
+        elif event["event"] == "tool_called":
+            self.tool_calls += 1
+        elif event["event"] == "agent_stopped":
+            print(f"[task {self.index}] {event['agent']} stopped: {event['reason']}")
+        elif event["event"] == "tests_finished":
+            print(f"[task {self.index}] local tests {event['status']}: {event['passed']}/{event['total']} "
+                  f"FAIL_TO_PASS passed in round {event['round']} ({event['duration']:.1f}s)")
+
+
+async def prepare_task(task, repo_cache, runtime, executor=None, scratch_dir=None):
+    """
+    Fetches the test case, checks out the repository at the requested commit from the
+    repository cache and opens the workspace of the task, a copy in scratch_dir if given.
+    When resuming a checkpointed agent run, its checkout is kept as it is.
+    """
+    loop = asyncio.get_running_loop()
+    api_url = f"{API_URL}{task.index}"
+    print(f"Fetching test case {task.index} from {api_url}...")
+    with task.timed("fetch"), span("task_api_request"):
+        response = await loop.run_in_executor(executor, requests.get, api_url)
+    if response.status_code != 200:
+        raise Exception(f"Invalid response: {response.status_code}")
+
+    testcase = response.json()
+    task.prompt = testcase["Problem_statement"]
+    git_clone = testcase["git_clone"]
+    task.fail_tests = json.loads(testcase.get("FAIL_TO_PASS", "[]"))
+    task.pass_tests = json.loads(testcase.get("PASS_TO_PASS", "[]"))
+    task.instance_id = testcase["instance_id"]
+
+    parts = git_clone.split("&&")
+    clone_part = parts[0].strip()
+    checkout_part = parts[-1].strip() if len(parts) > 1 else None
+    task.repo_name = parts[1].split()[1]
+
+    repo_url = clone_part.split()[2]
+    # The harness and the tools expect the repository in repo_<index>/<name>
+    repo_dir = os.path.join(task.repo_dir, task.repo_name)
+    commit_hash = checkout_part.split()[-1] if checkout_part else None
+
+    # A checkpointed run already changed the checkout, resetting it would lose those changes
+    checkpoint_status = await runtime.checkpoint_status(task.index) if task.resume else None
+    if checkpoint_status:
+        print(f"Resuming {checkpoint_status} agent run of test case {task.index}, keeping its checkout.")
+
+    print(f"Checking out {repo_url} at {commit_hash or 'default branch'} into {repo_dir}...")
+    env = os.environ.copy()
+    env["GIT_TERMINAL_PROMPT"] = "0"
+    with task.timed("clone"):
+        await repo_cache.checkout(repo_url, commit_hash, repo_dir, env=env, reset=checkpoint_status is None)
+        task.workspace = Workspace(repo_dir, scratch_dir)
+        await task.workspace.open(env)
+
+    # Build the search index of the directory the tools will work in while the task waits for an
+    # agent worker, not on the first search
+    with task.timed("index"):
+        await loop.run_in_executor(executor, get_search_index, task.workspace.root)
+
+
+async def finish_task(task, repo_cache, results_store, runtime=None):
+    """
+    Records the result of the task and frees its resources once it left the pipeline. The
+    checkpoints of an evaluated task are deleted from the runtime; only those of tasks that
+    errored are kept for resuming.
+    """
+    if task.workspace is not None:
+        drop_search_index(task.workspace.root)
+        await task.workspace.close()
+    if task.repo_name:
+        await repo_cache.release(os.path.join(task.repo_dir, task.repo_name))
+    results_store.write(task.record())
+    if runtime is not None and task.error is None and task.result is not None:
+        await runtime.discard_checkpoint(task.index)
+
+
+async def run_agents_for_task(task, runtime):
+    """
+    Runs the agent system on the prepared checkout.
+    """
+    print(f"Launching Agent-System (LangGraph) for test case {task.index}...")
+    with task.timed("agents"):
+        try:
+            state = await runtime.arun(task.index, task.prompt, task.repo_name, on_event=task.on_agent_event,
+                                       resume=task.resume, workspace=task.workspace, fail_tests=task.fail_tests)
+        finally:
+            # Also after a failure, so a resumed run continues from the changes made so far
+            await task.workspace.sync()
+    task.planner_result = state.get("planner_result")
+    task.coder_result = state.get("coder_result")
+    task.tester_result = state.get("tester_result")
+    print(f"Agents finished test case {task.index}: {task.input_tokens} input ({task.cached_tokens} cached) / "
+          f"{task.output_tokens} output tokens, {task.tool_calls} tool calls.")
+
+
+async def evaluate_task(task, executor=None):
+    """
+    Sends the modified repository to the SWE-Bench harness and stores the test results on the task.
+    If the FAIL_TO_PASS tests already failed locally, the task failed without a harness run.
+    """
+    index = task.index
+    repo_name = task.repo_name
+    if task.tester_result and task.tester_result["status"] == "failed":
+        fail_pass_passed = len(task.tester_result["passed"])
+        task.fail_to_pass = {"passed": fail_pass_passed, "total": len(task.fail_tests)}
+        task.result = False
+        print(f"Test case {index} failed locally: FAIL_TO_PASS {fail_pass_passed}/{len(task.fail_tests)}, "
+              f"skipping the harness.")
+        return
+    loop = asyncio.get_running_loop()
+    print(f"Calling SWE-Bench REST service with repo: repo_{index}/{repo_name}")
+    test_payload = {
+        "instance_id": task.instance_id,
+        "repoDir": f"/repos/repo_{index}/{repo_name}",
+        "FAIL_TO_PASS": task.fail_tests,
+        "PASS_TO_PASS": task.pass_tests
+    }
+    with task.timed("evaluation"), span("harness_request"):
+        res = await loop.run_in_executor(executor, lambda: requests.post(HARNESS_URL, json=test_payload))
+    res.raise_for_status()
+    result_raw = res.json().get("harnessOutput", "{}")
+    result_json = json.loads(result_raw)
+    if not result_json:
+        raise ValueError("No data in harnessOutput – possible evaluation error or empty result")
+    instance_id = next(iter(result_json))
+    tests_status = result_json[instance_id]["tests_status"]
+    fail_pass_results = tests_status["FAIL_TO_PASS"]
+    fail_pass_total = len(fail_pass_results["success"]) + len(fail_pass_results["failure"])
+    fail_pass_passed = len(fail_pass_results["success"])
+    pass_pass_results = tests_status["PASS_TO_PASS"]
+    pass_pass_total = len(pass_pass_results["success"]) + len(pass_pass_results["failure"])
+    pass_pass_passed = len(pass_pass_results["success"])
+
+    task.instance_id = instance_id
+    task.fail_to_pass = {"passed": fail_pass_passed, "total": fail_pass_total}
+    task.pass_to_pass = {"passed": pass_pass_passed, "total": pass_pass_total}
+    task.result = fail_pass_passed == fail_pass_total and pass_pass_passed == pass_pass_total
+    print(f"Test case {index} completed: FAIL_TO_PASS {fail_pass_passed}/{fail_pass_total}, "
+          f"PASS_TO_PASS {pass_pass_passed}/{pass_pass_total}.")
+
+
+async def fail_task(task, stage_name, e):
+    task.error = e
+    task.error_stage = stage_name
+    print(f"Error in test case {task.index} ({stage_name}): {e}")
+
+
+async def handle_task(index, repo_cache=None, executor=None, runtime=None, resume=False, results_store=None,
+                      scratch_dir=SCRATCH_DIR):
+    """
+    Runs a single SWE-Bench task end to end without the pipeline. Returns True if all tests
+    passed, False if some failed and None if the task errored.
+    """
+    task = Task(index, resume)
+    repo_cache = repo_cache or RepoCache(REPOS_ROOT)
+    results_store = results_store or ResultsStore()
+    owns_runtime = runtime is None
+    runtime = runtime or AgentRuntime(LITELLM_BASE_URL, OPENAI_API_KEY)
+    stages = (
+        ("prepare", lambda: prepare_task(task, repo_cache, runtime, executor, scratch_dir)),
+        ("agents", lambda: run_agents_for_task(task, runtime)),
+        ("evaluate", lambda: evaluate_task(task, executor)),
+    )
+    try:
+        for stage_name, stage in stages:
+            try:
+                await stage()
+            except Exception as e:
+                await fail_task(task, stage_name, e)
+                return None
+        return task.result
+    finally:
+        await finish_task(task, repo_cache, results_store, runtime)
+        if owns_runtime:
+            await runtime.aclose()
+
+
+async def run_batch(indices, prepare_workers=1, agent_workers=1, evaluate_workers=1, report_interval=60,
+                    repo_cache_budget=None, llm_cache=None, checkpointer=None, resume=False, results_store=None,
+                    metrics_path=None, scratch_dir=SCRATCH_DIR, llm=None, test_runner=None, rate_limiter=None):
+    """
+    Runs the given task indices through the prepare -> agents -> evaluate pipeline, so the
+    stages of different tasks overlap, records every task in the results store and reports
+    per-stage utilisation and throughput. The latency and token metrics of the whole run are
+    written to metrics_path, if given. With scratch_dir, the agents work on copies of the
+    checkouts there. llm replaces the chat model of the endpoint, e.g. with a scripted one. With
+    a test_runner, the FAIL_TO_PASS tests run locally before the harness, see AgentRuntime. All
+    LLM requests of the batch pass rate_limiter, if given.
+    """
+    results_store = results_store or ResultsStore()
+    run_id = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ-") + uuid.uuid4().hex[:6]
+    # Every prepare and evaluate worker may block one thread at a time (HTTP, search index)
+    executor = ThreadPoolExecutor(max_workers=prepare_workers + evaluate_workers,
+                                  thread_name_prefix="task")
+    repo_cache = RepoCache(REPOS_ROOT, disk_budget=repo_cache_budget)
+    # One compiled graph and connection pool for all tasks of the batch
+    runtime = AgentRuntime(LITELLM_BASE_URL, OPENAI_API_KEY, llm_cache, max_connections=max(10, agent_workers * 4),
+                           checkpointer=checkpointer, llm=llm, test_runner=test_runner, rate_limiter=rate_limiter)
+    tasks = [Task(index, resume, run_id) for index in indices]
+
+    async def evaluate_and_finish(task):
+        await evaluate_task(task, executor)
+        await finish_task(task, repo_cache, results_store, runtime)
+
+    async def fail_and_finish(task, stage_name, e):
+        await fail_task(task, stage_name, e)
+        await finish_task(task, repo_cache, results_store, runtime)
+
+    pipeline = Pipeline(
+        [
+            ("prepare", lambda task: prepare_task(task, repo_cache, runtime, executor, scratch_dir), prepare_workers),
+            ("agents", lambda task: run_agents_for_task(task, runtime), agent_workers),
+            ("evaluate", evaluate_and_finish, evaluate_workers),
+        ],
+        on_error=fail_and_finish,
+        report_interval=report_interval,
+    )
+    run_metrics = Metrics()
+    try:
+        with collect(run_metrics):
+            await pipeline.run(tasks)
+    finally:
+        executor.shutdown(wait=False)
+        await runtime.aclose()
+    elapsed = pipeline.elapsed()
+
+    print(f"\nBatch {run_id} finished: {len(indices)} tasks in {elapsed:.1f} seconds.")
+    pipeline.print_stats()
+    print_summary(summarize(results_store.read(run_id)))
+    run_metrics.print_summary()
+    if metrics_path:
+        run_metrics.write(metrics_path)
+        print(f"Metrics written to {metrics_path}")
+    if llm_cache is not None:
+        print(f"LLM response cache: {llm_cache.stats()}")
+    return [task.result for task in tasks]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=APP_NAME)
+    parser.add_argument("indices", nargs="?", default="7",
+                        help="Task indices to run, e.g. '1-10,15,20-22' (default: 7)")
+    parser.add_argument("-c", "--concurrency", type=int, default=1,
+                        help="Default number of workers per pipeline stage (default: 1)")
+    parser.add_argument("--prepare-workers", type=int,
+                        help="Workers fetching and checking out repositories (default: --concurrency)")
+    parser.add_argument("--agent-workers", type=int,
+                        help="Workers running the agent system (default: --concurrency)")
+    parser.add_argument("--evaluate-workers", type=int,
+                        help="Workers waiting on the SWE-Bench harness (default: --concurrency)")
+    parser.add_argument("--report-interval", type=float, default=60,
+                        help="Seconds between pipeline status reports, 0 to disable (default: 60)")
+    parser.add_argument("--repo-cache-budget-gb", type=float,
+                        help="Disk budget of the repository cache; least recently used checkouts and "
+                             "mirrors are evicted beyond it (default: unlimited)")
+    parser.add_argument("--llm-cache", default=os.getenv("LLM_CACHE_PATH"),
+                        help="SQLite file caching LLM responses, so re-runs replay identical requests "
+                             "(default: $LLM_CACHE_PATH, disabled if unset)")
+    parser.add_argument("--llm-cache-max-mb", type=float, default=DEFAULT_MAX_BYTES / 1024 ** 2,
+                        help="Size limit of the LLM response cache (default: %(default).0f)")
+    parser.add_argument("--checkpoints", default=os.getenv("CHECKPOINT_DB", CHECKPOINT_DB),
+                        help="SQLite file storing the agent graph state of every task after each node, "
+                             "kept until the task is evaluated "
+                             "(default: $CHECKPOINT_DB or %(default)s, '' to disable)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue checkpointed agent runs from their last completed node instead of starting over")
+    parser.add_argument("--skip-completed", action="store_true",
+                        help="Skip tasks that already have test results in the results file")
+    parser.add_argument("--results", default=RESULTS_FILE,
+                        help="JSONL file the task results are appended to (default: %(default)s)")
+    parser.add_argument("--scratch-dir", default=SCRATCH_DIR,
+                        help="Let the agents work on disposable copies of the checkouts in this directory, e.g. "
+                             "on tmpfs, and copy their changes back for evaluation (default: $SCRATCH_DIR, off). "
+                             f"The checkouts themselves live in $REPOS_ROOT ({REPOS_ROOT})")
+    parser.add_argument("--metrics",
+                        help="Write the latency and token histograms of the run to this file, in the Prometheus "
+                             "text format if it ends in .prom and as JSON otherwise")
+    parser.add_argument("--llm-rpm", type=int, default=LLM_REQUESTS_PER_MINUTE,
+                        help="Requests per minute sent to the LLM endpoint by all agents together "
+                             "(default: $LLM_REQUESTS_PER_MINUTE, unlimited if unset)")
+    parser.add_argument("--llm-tpm", type=int, default=LLM_TOKENS_PER_MINUTE,
+                        help="Tokens per minute sent to the LLM endpoint by all agents together "
+                             "(default: $LLM_TOKENS_PER_MINUTE, unlimited if unset)")
+    parser.add_argument("--local-tests", action="store_true",
+                        help="Run the FAIL_TO_PASS tests in the checkout after the coder, send failures back to "
+                             "the coder and only call the harness if they did not conclusively fail")
+    parser.add_argument("--local-test-python", default=LOCAL_TEST_PYTHON,
+                        help="Python interpreter running the local tests, of an environment with the "
+                             f"dependencies of the repositories (default: $LOCAL_TEST_PYTHON or {sys.executable})")
+    parser.add_argument("--local-test-timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help="Seconds a local test run may take before it counts as inconclusive "
+                             "(default: %(default)s)")
+    args = parser.parse_args(argv)
+    if args.resume and not args.checkpoints:
+        parser.error("--resume needs --checkpoints")
+    for name in ("prepare_workers", "agent_workers", "evaluate_workers"):
+        if getattr(args, name) is None:
+            setattr(args, name, args.concurrency)
+        if getattr(args, name) < 1:
+            parser.error(f"--{name.replace('_', '-')} must be at least 1")
+    return args
+
+
+async def main(argv=None):
+    args = parse_args(argv)
+    indices = parse_indices(args.indices)
+    results_store = ResultsStore(args.results)
+    if args.skip_completed:
+        completed = results_store.completed_indices()
+        skipped = [index for index in indices if index in completed]
+        indices = [index for index in indices if index not in completed]
+        print(f"Skipping {len(skipped)} completed task(s): {skipped}")
+
+    repo_cache_budget = int(args.repo_cache_budget_gb * 1024 ** 3) if args.repo_cache_budget_gb else None
+    async with AsyncExitStack() as stack:
+        llm_cache = None
+        if args.llm_cache:
+            llm_cache = LLMResponseCache(args.llm_cache, int(args.llm_cache_max_mb * 1024 ** 2))
+            stack.callback(llm_cache.close)
+        checkpointer = None
+        if args.checkpoints:
+            checkpointer = await stack.enter_async_context(AsyncSqliteSaver.from_conn_string(args.checkpoints))
+            # Create the tables now, so an unusable checkpoint database fails the run before any task starts
+            await checkpointer.setup()
+        test_runner = LocalTestRunner(args.local_test_python, args.local_test_timeout) if args.local_tests else None
+        await run_batch(indices, args.prepare_workers, args.agent_workers, args.evaluate_workers,
+                        args.report_interval, repo_cache_budget, llm_cache, checkpointer, args.resume,
+                        results_store, args.metrics, args.scratch_dir, test_runner=test_runner,
+                        rate_limiter=RateLimiter(args.llm_rpm, args.llm_tpm))
 
 
 if __name__ == "__main__":
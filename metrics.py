@@ -0,0 +1,199 @@
+import bisect
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the histogram buckets for durations in seconds and for token counts
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+TOKEN_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 20000, 40000, 60000, 100000, 150000)
+PROMETHEUS_PREFIX = "swebench_"
+
+# Registries that observations are currently recorded in, innermost last
+_active = contextvars.ContextVar("metrics_registries", default=())
+
+
+class Histogram:
+    """
+    Count, sum, extremes and bucket counts of observed values.
+    """
+
+    def __init__(self, buckets=SECONDS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """
+        Estimates a quantile by linear interpolation within its bucket, like Prometheus does.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for position, bucket_count in enumerate(self.bucket_counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[position - 1] if position else 0.0
+                upper = self.buckets[position] if position < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / bucket_count, self.max)
+            seen += bucket_count
+        return self.max
+
+    def to_dict(self, buckets=True):
+        summary = {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "min": self.min,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+        if buckets:
+            summary["buckets"] = dict(zip([str(bound) for bound in self.buckets] + ["+Inf"], self.bucket_counts))
+        return summary
+
+
+class Metrics:
+    """
+    Thread-safe registry of histograms and counters, each identified by a name and labels.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def snapshot(self, buckets=True):
+        """
+        Returns all metrics as a JSON-serialisable dict, optionally without the bucket counts.
+        """
+        with self._lock:
+            return {
+                "histograms": [{"name": name, "labels": dict(labels), **histogram.to_dict(buckets)}
+                               for (name, labels), histogram in sorted(self._histograms.items())],
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in sorted(self._counters.items())],
+            }
+
+    def to_prometheus(self):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        typed = set()
+        with self._lock:
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                metric = PROMETHEUS_PREFIX + name
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} histogram")
+                    typed.add(metric)
+                cumulative = 0
+                for bound, bucket_count in zip(list(histogram.buckets) + ["+Inf"], histogram.bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f"{metric}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{metric}_count{_format_labels(labels)} {histogram.count}")
+            for (name, labels), value in sorted(self._counters.items()):
+                metric = PROMETHEUS_PREFIX + name + "_total"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{metric}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Writes the metrics to path, in the Prometheus text format if it ends in .prom and as
+        JSON otherwise.
+        """
+        content = self.to_prometheus() if path.endswith(".prom") else json.dumps(self.snapshot(), indent=2)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(content)
+
+    def print_summary(self, limit=20):
+        """
+        Prints the duration histograms with the largest total time first.
+        """
+        with self._lock:
+            rows = [(name, labels, histogram) for (name, labels), histogram in self._histograms.items()
+                    if name.endswith("_seconds")]
+        rows.sort(key=lambda row: row[2].sum, reverse=True)
+        print(f"{'span':<50} {'count':>7} {'total s':>10} {'mean s':>8} {'p90 s':>8} {'max s':>8}")
+        for name, labels, histogram in rows[:limit]:
+            label = name[:-len("_seconds")] + (_format_labels(labels) if labels else "")
+            print(f"{label[:50]:<50} {histogram.count:>7} {histogram.sum:>10.1f} "
+                  f"{histogram.sum / histogram.count:>8.2f} {histogram.quantile(0.9):>8.2f} {histogram.max:>8.2f}")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(labels, escaped)) + "}"
+
+
+@contextmanager
+def collect(metrics):
+    """
+    Records all observations made in the with block, including those in tasks and tool threads
+    started from it, in metrics as well as in the registries already collecting.
+    """
+    token = _active.set(_active.get() + (metrics,))
+    try:
+        yield metrics
+    finally:
+        _active.reset(token)
+
+
+def observe(name, value, buckets=SECONDS_BUCKETS, **labels):
+    for metrics in _active.get():
+        metrics.observe(name, value, buckets, **labels)
+
+
+def inc(name, value=1, **labels):
+    for metrics in _active.get():
+        metrics.inc(name, value, **labels)
+
+
+@contextmanager
+def span(name, **labels):
+    """
+    Observes the duration of the with block as <name>_seconds, labelled with status "ok" or
+    "error" depending on whether the block raised.
+    """
+    start_time = time.monotonic()
+    status = "error"
+    try:
+        yield
+        status = "ok"
+    finally:
+        observe(f"{name}_seconds", time.monotonic() - start_time, status=status, **labels)
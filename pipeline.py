@@ -0,0 +1,144 @@
+import asyncio
+import time
+
+
+class Stage:
+    """
+    A pipeline stage with its own input queue and a fixed number of workers. A queue with a
+    maxsize makes put() wait until the stage has room for the item.
+    """
+
+    def __init__(self, name, handler, workers, maxsize=0):
+        if workers < 1:
+            raise ValueError(f"Stage '{name}' needs at least one worker.")
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize)
+        self.active = 0
+        self.busy_time = 0.0
+        self.processed = 0
+        self.failed = 0
+        self.max_queue_depth = 0
+
+    async def put(self, item):
+        await self.queue.put(item)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    def stats(self, elapsed):
+        """
+        Returns queue depth and utilisation (share of worker time spent busy) of the stage.
+        """
+        capacity = self.workers * elapsed
+        return {
+            "workers": self.workers,
+            "queue_depth": self.queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "active": self.active,
+            "processed": self.processed,
+            "failed": self.failed,
+            "busy_seconds": round(self.busy_time, 2),
+            "utilisation": round(self.busy_time / capacity, 3) if capacity > 0 else 0.0,
+        }
+
+
+class Pipeline:
+    """
+    Runs items through a sequence of stages. Every stage has its own queue and worker count, so
+    item N can be in the last stage while item N+1 is in the middle one and N+2 in the first.
+
+    A stage handler is an async callable taking the item. If it raises, the item leaves the
+    pipeline and `on_error(item, stage_name, exception)` is awaited.
+
+    Only the first stage queues all items. Every later stage queues at most one item per worker,
+    so a fast stage waits for the slower one behind it instead of running through the whole
+    batch ahead of it.
+    """
+
+    def __init__(self, stages, on_error=None, report_interval=None):
+        self.stages = [Stage(name, handler, workers, maxsize=workers if position > 0 else 0)
+                       for position, (name, handler, workers) in enumerate(stages)]
+        self.on_error = on_error
+        self.report_interval = report_interval
+        self._start_time = None
+        self._remaining = 0
+        self._finished = None
+
+    def elapsed(self):
+        return time.monotonic() - self._start_time if self._start_time else 0.0
+
+    def stats(self):
+        elapsed = self.elapsed()
+        return {stage.name: stage.stats(elapsed) for stage in self.stages}
+
+    def print_stats(self):
+        print(f"Pipeline status after {self.elapsed():.1f} seconds:")
+        for name, stats in self.stats().items():
+            print(f"  {name:<10} queue={stats['queue_depth']:<4} active={stats['active']}/{stats['workers']} "
+                  f"done={stats['processed']} failed={stats['failed']} "
+                  f"utilisation={stats['utilisation'] * 100:.0f}%")
+
+    def _item_done(self):
+        self._remaining -= 1
+        if self._remaining == 0:
+            self._finished.set()
+
+    async def _worker(self, position):
+        stage = self.stages[position]
+        next_stage = self.stages[position + 1] if position + 1 < len(self.stages) else None
+        while True:
+            item = await stage.queue.get()
+            stage.active += 1
+            start_time = time.monotonic()
+            try:
+                await stage.handler(item)
+            except Exception as e:
+                stage.failed += 1
+                try:
+                    if self.on_error is not None:
+                        await self.on_error(item, stage.name, e)
+                except Exception as handler_error:
+                    # The item still has to leave the pipeline, or run() would wait forever
+                    print(f"Error handler failed in stage {stage.name}: {handler_error!r}")
+                finally:
+                    self._item_done()
+                continue
+            finally:
+                stage.busy_time += time.monotonic() - start_time
+                stage.active -= 1
+                stage.queue.task_done()
+            stage.processed += 1
+            if next_stage is not None:
+                await next_stage.put(item)
+            else:
+                self._item_done()
+
+    async def _reporter(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self.print_stats()
+
+    async def run(self, items):
+        """
+        Feeds all items into the first stage and waits until every item left the pipeline.
+        """
+        items = list(items)
+        self._start_time = time.monotonic()
+        self._remaining = len(items)
+        self._finished = asyncio.Event()
+        if not items:
+            return
+
+        for item in items:
+            await self.stages[0].put(item)
+        workers = [asyncio.create_task(self._worker(position))
+                   for position, stage in enumerate(self.stages)
+                   for _ in range(stage.workers)]
+        if self.report_interval:
+            workers.append(asyncio.create_task(self._reporter()))
+        try:
+            await self._finished.wait()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
@@ -0,0 +1,193 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import random
+import time
+from contextlib import contextmanager
+import httpx
+import openai
+from compaction import estimate_tokens
+from metrics import SECONDS_BUCKETS, inc, observe
+
+# Retries of a failed LLM request, with exponential backoff between BACKOFF_BASE and BACKOFF_MAX seconds
+MAX_RETRIES = 6
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+# Output tokens reserved for a request until its actual usage is known
+ESTIMATED_OUTPUT_TOKENS = 1000
+
+# Priority of the LLM requests made in the current context, higher is served first
+_priority = contextvars.ContextVar("llm_request_priority", default=0)
+
+
+@contextmanager
+def request_priority(priority):
+    """
+    Sets the priority of the LLM requests made in the with block.
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class RateLimiter:
+    """
+    Token buckets for requests and tokens per minute, shared by all LLM requests of a process.
+    Both buckets hold one minute of their rate and refill continuously; a limit of None is not
+    enforced. Waiting requests are admitted by priority, and in arrival order within a priority.
+
+    Token counts are estimates when a request is admitted; record() settles the difference to
+    the actual usage. pause() holds back all requests, e.g. when the endpoint answered 429.
+
+    Like the runtime it belongs to, a limiter must only be used from one event loop.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute or 0)
+        self._tokens = float(tokens_per_minute or 0)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        # Heap of (-priority, arrival, tokens, future)
+        self._waiters = []
+        self._arrivals = itertools.count()
+        self._timer = None
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def _wait_time(self, tokens):
+        wait = self._paused_until - time.monotonic()
+        if self.requests_per_minute and self._requests < 1:
+            wait = max(wait, (1 - self._requests) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute and self._tokens < tokens:
+            wait = max(wait, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+        return wait
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._refill()
+        while self._waiters:
+            _, _, tokens, future = self._waiters[0]
+            if future.done():
+                # Cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            wait = self._wait_time(tokens)
+            if wait > 0:
+                # Lower priorities wait behind the first waiter, so it is not starved
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._waiters)
+            self._requests -= 1
+            self._tokens -= tokens
+            future.set_result(None)
+
+    async def acquire(self, tokens=0, priority=0):
+        """
+        Waits until a request of the given estimated tokens may be sent and returns the seconds
+        waited.
+        """
+        start_time = time.monotonic()
+        if self.tokens_per_minute:
+            # A request larger than the bucket would wait forever
+            tokens = min(tokens, self.tokens_per_minute)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (-priority, next(self._arrivals), tokens, future))
+        self._dispatch()
+        await future
+        return time.monotonic() - start_time
+
+    def record(self, estimated_tokens, actual_tokens):
+        """
+        Settles the estimate of an admitted request with its actual token usage.
+        """
+        self._refill()
+        if self.tokens_per_minute:
+            self._tokens -= actual_tokens - min(estimated_tokens, self.tokens_per_minute)
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+def retry_reason(error):
+    """
+    Returns the HTTP status code or "connection" if a failed LLM request should be retried,
+    otherwise None.
+    """
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status if status == 429 or status >= 500 else None
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError)):
+        return "connection"
+    return None
+
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    Returns the seconds to wait before retry attempt (0-based): exponential backoff with jitter,
+    but at least the Retry-After of the endpoint.
+    """
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+    return max(random.uniform(delay / 2, delay), retry_after or 0.0)
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class RateLimitedChatModel:
+    """
+    Wraps a chat model with bound tools so its requests pass the rate limiter, and retries
+    requests that failed with 429, 5xx or a connection error. The time spent waiting for the
+    limiter and in backoff is observed as llm_throttled_seconds.
+    """
+
+    def __init__(self, llm, limiter, max_retries=MAX_RETRIES):
+        self.llm = llm
+        self.limiter = limiter
+        self.max_retries = max_retries
+
+    async def ainvoke(self, messages):
+        estimated_tokens = estimate_tokens(messages) + ESTIMATED_OUTPUT_TOKENS
+        throttled = 0.0
+        for attempt in itertools.count():
+            throttled += await self.limiter.acquire(estimated_tokens, _priority.get())
+            try:
+                message = await self.llm.ainvoke(messages)
+            except Exception as e:
+                reason = retry_reason(e)
+                # The endpoint did not count the request
+                self.limiter.record(estimated_tokens, 0)
+                if reason is None or attempt >= self.max_retries:
+                    observe("llm_throttled_seconds", throttled, SECONDS_BUCKETS)
+                    raise
+                delay = backoff_delay(attempt, _retry_after(e))
+                if reason == 429:
+                    # Over the limit of the endpoint, all requests back off
+                    self.limiter.pause(delay)
+                inc("llm_retries", reason=str(reason))
+                print(f"LLM request failed ({reason}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s...")
+                await asyncio.sleep(delay)
+                throttled += delay
+                continue
+            usage = message.usage_metadata or {}
+            self.limiter.record(estimated_tokens, usage.get("total_tokens", estimated_tokens))
+            observe("llm_throttled_seconds", throttled, SECONDS_BUCKETS)
+            return message
@@ -0,0 +1,265 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from collections import Counter
+from metrics import span
+
+
+async def run_git(*args, cwd=None, env=None, check=True):
+    """
+    Runs a git command without blocking the event loop. Raises CalledProcessError on failure
+    unless check is False, in which case the return code is returned.
+    """
+    with span("git", command=args[0]):
+        process = await asyncio.create_subprocess_exec("git", *args, cwd=cwd, env=env)
+        returncode = await process.wait()
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, ["git", *args])
+    return returncode
+
+
+async def git_output(*args, cwd=None, env=None, input=None):
+    """
+    Runs a git command without blocking the event loop, feeding it input, and returns its
+    stdout. Raises CalledProcessError on failure.
+    """
+    with span("git", command=args[0]):
+        process = await asyncio.create_subprocess_exec(
+            "git", *args, cwd=cwd, env=env, stdout=subprocess.PIPE,
+            stdin=subprocess.PIPE if input is not None else None,
+        )
+        stdout, _ = await process.communicate(input)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, ["git", *args], stdout)
+    return stdout
+
+
+def _disk_usage(path, seen=None):
+    """
+    Returns the bytes allocated below path, counting hardlinked files only once. Files whose inode
+    is in seen already are skipped, so with one seen set across several paths every hardlinked
+    file counts for the first path it was found in.
+    """
+    seen = set() if seen is None else seen
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                stat = os.lstat(os.path.join(root, file))
+            except OSError:
+                continue
+            if (stat.st_dev, stat.st_ino) in seen:
+                continue
+            seen.add((stat.st_dev, stat.st_ino))
+            total += stat.st_blocks * 512
+    return total
+
+
+def _freed_bytes(path):
+    """
+    Returns the bytes removing path would free, i.e. of the files without hardlinks outside of it.
+    """
+    links = Counter()
+    stats = {}
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                stat = os.lstat(os.path.join(root, file))
+            except OSError:
+                continue
+            links[(stat.st_dev, stat.st_ino)] += 1
+            stats[(stat.st_dev, stat.st_ino)] = stat
+    return sum(stat.st_blocks * 512 for inode, stat in stats.items() if links[inode] >= stat.st_nlink)
+
+
+class RepoCache:
+    """
+    Local cache of upstream repositories. Every upstream URL is fetched once into a bare mirror,
+    and task checkouts are local clones of that mirror. Local clones hardlink the object store
+    instead of copying it, and unlike `git worktree` checkouts their `.git` does not point back
+    at the mirror, so the harness can still use them when the repos directory is mounted
+    elsewhere.
+
+    If a disk budget is set, least recently used checkouts (then mirrors) are evicted after
+    each checkout until the cache fits into the budget again. Checkouts in use are never evicted.
+    The usage file records the last use and the size of every mirror and checkout; a path is only
+    measured when it was created or changed, so eviction does not walk the whole cache.
+    """
+
+    def __init__(self, repos_dir, disk_budget=None):
+        self.repos_dir = repos_dir
+        self.cache_dir = os.path.join(repos_dir, ".cache")
+        self.mirrors_dir = os.path.join(self.cache_dir, "mirrors")
+        self.usage_file = os.path.join(self.cache_dir, "usage.json")
+        self.disk_budget = disk_budget
+        self._mirror_locks = {}
+        self._mirror_users = Counter()
+        self._in_use = set()
+        self._usage = None
+        self._usage_lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+
+    def mirror_path(self, repo_url):
+        name = re.sub(r"[^A-Za-z0-9._-]", "_", repo_url.rstrip("/").split("/")[-1].removesuffix(".git"))
+        digest = hashlib.sha1(repo_url.encode("utf-8")).hexdigest()[:8]
+        return os.path.join(self.mirrors_dir, f"{name}-{digest}.git")
+
+    async def _ensure_mirror(self, repo_url, commit_hash, env):
+        mirror = self.mirror_path(repo_url)
+        lock = self._mirror_locks.setdefault(mirror, asyncio.Lock())
+        async with lock:
+            changed = not os.path.exists(mirror)
+            if changed:
+                print(f"Creating mirror of {repo_url} in {mirror}...")
+                os.makedirs(self.mirrors_dir, exist_ok=True)
+                await run_git("clone", "--bare", "--quiet", repo_url, mirror, env=env)
+            if commit_hash:
+                if await run_git("cat-file", "-e", f"{commit_hash}^{{commit}}", cwd=mirror, env=env,
+                                 check=False) != 0:
+                    print(f"Fetching commit {commit_hash} into mirror {mirror}...")
+                    await run_git("fetch", "--quiet", repo_url, commit_hash, cwd=mirror, env=env)
+                    changed = True
+                # A ref keeps the commit reachable, so local clones and fetches pick it up
+                await run_git("update-ref", f"refs/cache/{commit_hash}", commit_hash, cwd=mirror, env=env)
+            await asyncio.to_thread(self._touch, mirror, measure=changed)
+        return mirror
+
+    async def checkout(self, repo_url, commit_hash, dest, env=None, reset=True):
+        """
+        Makes dest a checkout of repo_url at commit_hash (or the default branch if None). An
+        existing checkout is reused and forcibly reset to the commit, unless reset is False, in
+        which case it is kept as it is.
+        """
+        self._in_use.add(dest)
+        if not reset and os.path.exists(os.path.join(dest, ".git")):
+            await asyncio.to_thread(self._touch, dest)
+            return dest
+        mirror = self.mirror_path(repo_url)
+        self._mirror_users[mirror] += 1
+        try:
+            await self._checkout_from_mirror(repo_url, commit_hash, dest, env)
+        finally:
+            self._mirror_users[mirror] -= 1
+        if self.disk_budget is not None:
+            await asyncio.to_thread(self.evict)
+        return dest
+
+    async def _checkout_from_mirror(self, repo_url, commit_hash, dest, env):
+        mirror = await self._ensure_mirror(repo_url, commit_hash, env)
+        if not os.path.exists(os.path.join(dest, ".git")):
+            if os.path.exists(dest):
+                shutil.rmtree(dest)
+            print(f"Checking out {repo_url} into {dest} from mirror...")
+            await run_git("clone", "--local", "--quiet", "--no-checkout", mirror, dest, env=env)
+            await run_git("remote", "set-url", "origin", repo_url, cwd=dest, env=env)
+        if commit_hash:
+            if await run_git("cat-file", "-e", f"{commit_hash}^{{commit}}", cwd=dest, env=env, check=False) != 0:
+                await run_git("fetch", "--quiet", mirror, f"refs/cache/{commit_hash}", cwd=dest, env=env)
+            await run_git("checkout", "--quiet", "--force", "--detach", commit_hash, cwd=dest, env=env)
+        else:
+            await run_git("checkout", "--quiet", "--force", "--detach", "origin/HEAD", cwd=dest, env=env)
+        # Reset the working directory completely
+        await run_git("reset", "--quiet", "--hard", cwd=dest, env=env)
+        await asyncio.to_thread(self._touch, dest, measure=True, mirror=mirror)
+
+    async def release(self, dest):
+        """
+        Marks a checkout as no longer in use, so it may be evicted.
+        """
+        self._in_use.discard(dest)
+        if os.path.exists(dest):
+            await asyncio.to_thread(self._touch, dest)
+
+    def _load_usage(self):
+        """
+        Returns the usage entries, {"last_used", "size", "mirror"} by path, read from the usage
+        file on first use. Must be called with the usage lock held.
+        """
+        if self._usage is None:
+            try:
+                with open(self.usage_file, "r", encoding="utf-8") as file:
+                    usage = json.load(file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                usage = {}
+            # Older usage files only hold the last use, their paths are measured on the next eviction
+            self._usage = {path: entry if isinstance(entry, dict) else {"last_used": entry}
+                           for path, entry in usage.items()}
+        return self._usage
+
+    def _save_usage(self, usage):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_file = f"{self.usage_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as file:
+            json.dump(usage, file, indent=2)
+        os.replace(tmp_file, self.usage_file)
+
+    def _measure(self, path, mirror=None):
+        """
+        Returns the bytes path adds to the cache. Objects a checkout hardlinks from its mirror
+        count for the mirror only.
+        """
+        if mirror is None or not os.path.exists(mirror):
+            return _disk_usage(path)
+        return _freed_bytes(path)
+
+    def _touch(self, path, measure=False, mirror=None):
+        """
+        Records the use of path and, with measure, its size, if a disk budget is set. Blocks on
+        the disk, so the event loop calls it in a thread.
+        """
+        size = self._measure(path, mirror) if measure and self.disk_budget is not None else None
+        with self._usage_lock:
+            usage = self._load_usage()
+            entry = usage.setdefault(path, {})
+            entry["last_used"] = time.time()
+            if mirror is not None:
+                entry["mirror"] = mirror
+            if measure:
+                entry["size"] = size
+            self._save_usage(usage)
+
+    def evict(self):
+        """
+        Removes least recently used checkouts, and then mirrors, until the cache fits the disk budget.
+        """
+        with self._evict_lock:
+            with self._usage_lock:
+                usage = {path: dict(entry) for path, entry in self._load_usage().items() if os.path.exists(path)}
+            # Only paths recorded without a size, e.g. before a budget was set, are measured here
+            for path, entry in usage.items():
+                if entry.get("size") is None:
+                    entry["size"] = self._measure(path, entry.get("mirror"))
+            total = sum(entry["size"] for entry in usage.values())
+            mirrors = [path for path in usage if path.startswith(self.mirrors_dir + os.sep)]
+            checkouts = [path for path in usage if path not in mirrors]
+            candidates = sorted(checkouts, key=lambda path: usage[path]["last_used"]) + \
+                sorted(mirrors, key=lambda path: usage[path]["last_used"])
+            evicted = set()
+            for path in candidates:
+                if total <= self.disk_budget:
+                    break
+                if path in self._in_use or self._mirror_users[path] > 0:
+                    continue
+                # Objects shared with remaining checkouts stay on disk when a mirror is removed
+                freed = _freed_bytes(path) if path in mirrors else usage[path]["size"]
+                print(f"Evicting {path} ({freed / 1024 ** 2:.0f} MiB) from repository cache...")
+                shutil.rmtree(path, ignore_errors=True)
+                evicted.add(path)
+                total -= freed
+            with self._usage_lock:
+                stored = self._load_usage()
+                for path in list(stored):
+                    if path in evicted or not os.path.exists(path):
+                        del stored[path]
+                    elif path in usage and stored[path].get("size") is None:
+                        stored[path]["size"] = usage[path]["size"]
+                    if path in stored and stored[path].get("mirror") in evicted:
+                        # The objects it hardlinked from the mirror now count for the checkout
+                        stored[path]["size"] = None
+                self._save_usage(stored)
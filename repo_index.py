@@ -0,0 +1,56 @@
+import os
+import subprocess
+import threading
+from metrics import span
+
+# Directories that are never worth listing when the repository is not a git checkout
+IGNORED_DIRS = {".git", "__pycache__", ".tox", ".nox", ".venv", "venv", "node_modules", "build", "dist",
+                ".eggs", ".mypy_cache", ".pytest_cache"}
+
+_file_indexes = {}
+_lock = threading.Lock()
+
+
+def _build_file_index(repo_path):
+    try:
+        # Lists tracked and untracked-but-not-ignored files relative to repo_path, respecting .gitignore
+        with span("git", command="ls-files"):
+            output = subprocess.run(
+                ["git", "ls-files", "--cached", "--others", "--exclude-standard", "-z"],
+                cwd=repo_path, check=True, capture_output=True,
+            ).stdout.decode("utf-8", errors="surrogateescape")
+        files = [path for path in output.split("\0") if path and os.path.lexists(os.path.join(repo_path, path))]
+    except (OSError, subprocess.CalledProcessError):
+        files = []
+        for root, dirs, names in os.walk(repo_path):
+            dirs[:] = [name for name in dirs if name not in IGNORED_DIRS and not name.endswith(".egg-info")]
+            for name in names:
+                files.append(os.path.relpath(os.path.join(root, name), repo_path))
+    return sorted(set(files))
+
+
+def get_file_index(repo_path):
+    """
+    Returns the sorted list of files in the repository, relative to repo_path. The list is built
+    once per repository and cached until invalidate_file_index is called.
+    """
+    repo_path = os.path.abspath(repo_path)
+    with _lock:
+        files = _file_indexes.get(repo_path)
+    if files is None:
+        files = _build_file_index(repo_path)
+        with _lock:
+            _file_indexes[repo_path] = files
+    return files
+
+
+def invalidate_file_index(path):
+    """
+    Drops the cached file index of every repository containing path. Write tools call this after
+    changing a file.
+    """
+    path = os.path.abspath(path)
+    with _lock:
+        for repo_path in list(_file_indexes):
+            if path == repo_path or path.startswith(repo_path + os.sep):
+                del _file_indexes[repo_path]
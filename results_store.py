@@ -0,0 +1,141 @@
+import argparse
+import datetime
+import fcntl
+import json
+import os
+import threading
+
+RESULTS_FILE = "results.jsonl"
+STAGES = ("fetch", "clone", "index", "agents", "evaluation")
+
+
+class ResultsStore:
+    """
+    Append-only JSONL file with one record per task run. Every record is written with a single
+    append under an exclusive file lock, so concurrent tasks and processes never interleave.
+    """
+
+    def __init__(self, path=RESULTS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        data = (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        with self._lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+
+    def read(self, run_id=None):
+        """
+        Returns all records, or those of a single run. Incomplete lines are skipped.
+        """
+        records = []
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if run_id is None or record.get("run_id") == run_id:
+                        records.append(record)
+        except FileNotFoundError:
+            pass
+        return records
+
+    def completed_indices(self):
+        """
+        Returns the indices of the tasks that have test results in any run.
+        """
+        return {record["index"] for record in self.read() if record.get("status") in ("passed", "failed")}
+
+
+def _percentile(values, percentile):
+    values = sorted(values)
+    if not values:
+        return None
+    position = (len(values) - 1) * percentile / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return round(values[lower] + (values[upper] - values[lower]) * (position - lower), 2)
+
+
+def summarize(records):
+    """
+    Aggregates task records into success rate, throughput, latency percentiles per stage and
+    token usage.
+    """
+    statuses = [record.get("status") for record in records]
+    evaluated = statuses.count("passed") + statuses.count("failed")
+    summary = {
+        "tasks": len(records),
+        "passed": statuses.count("passed"),
+        "failed": statuses.count("failed"),
+        "errors": statuses.count("error"),
+        "success_rate": round(statuses.count("passed") / len(records), 3) if records else 0.0,
+        "success_rate_evaluated": round(statuses.count("passed") / evaluated, 3) if evaluated else 0.0,
+    }
+
+    started = [record["started_at"] for record in records if record.get("started_at")]
+    finished = [record["finished_at"] for record in records if record.get("finished_at")]
+    if started and finished:
+        wall_time = (datetime.datetime.fromisoformat(max(finished).rstrip("Z")) -
+                     datetime.datetime.fromisoformat(min(started).rstrip("Z"))).total_seconds()
+        summary["wall_time_seconds"] = round(wall_time, 1)
+        summary["throughput_tasks_per_hour"] = round(len(records) / (wall_time / 3600), 1) if wall_time > 0 else None
+
+    latencies = {}
+    for stage in STAGES + ("total",):
+        values = [record["timings"][stage] for record in records if record.get("timings", {}).get(stage) is not None]
+        if values:
+            latencies[stage] = {"p50": _percentile(values, 50), "p90": _percentile(values, 90),
+                                "p99": _percentile(values, 99), "max": round(max(values), 2)}
+    summary["latency_seconds"] = latencies
+
+    summary["input_tokens"] = sum(record.get("tokens", {}).get("input", 0) for record in records)
+    summary["output_tokens"] = sum(record.get("tokens", {}).get("output", 0) for record in records)
+    summary["cached_tokens"] = sum(record.get("tokens", {}).get("cached", 0) for record in records)
+    summary["cached_token_ratio"] = (round(summary["cached_tokens"] / summary["input_tokens"], 3)
+                                     if summary["input_tokens"] else 0.0)
+    summary["compaction_saved_tokens"] = sum(record.get("tokens", {}).get("compaction_saved", 0) for record in records)
+    summary["tool_calls"] = sum(record.get("tool_calls", 0) for record in records)
+    errors = {}
+    for record in records:
+        if record.get("error_class"):
+            errors[record["error_class"]] = errors.get(record["error_class"], 0) + 1
+    summary["error_classes"] = errors
+    return summary
+
+
+def print_summary(summary):
+    print(f"Tasks: {summary['tasks']} (passed {summary['passed']}, failed {summary['failed']}, "
+          f"errors {summary['errors']})")
+    print(f"Success rate: {summary['success_rate'] * 100:.1f}% "
+          f"({summary['success_rate_evaluated'] * 100:.1f}% of evaluated tasks)")
+    if summary.get("throughput_tasks_per_hour") is not None:
+        print(f"Throughput: {summary['throughput_tasks_per_hour']} tasks/hour "
+              f"over {summary['wall_time_seconds']} seconds")
+    for stage, latency in summary["latency_seconds"].items():
+        print(f"  {stage:<11} p50={latency['p50']}s p90={latency['p90']}s p99={latency['p99']}s max={latency['max']}s")
+    print(f"Tokens: {summary['input_tokens']} input ({summary['cached_token_ratio'] * 100:.1f}% from the prompt "
+          f"cache) / {summary['output_tokens']} output, {summary['tool_calls']} tool calls, "
+          f"{summary['compaction_saved_tokens']} saved by compaction")
+    if summary["error_classes"]:
+        print(f"Errors: {summary['error_classes']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarizes the task results of SWE-Bench runs.")
+    parser.add_argument("path", nargs="?", default=RESULTS_FILE, help="Results file (default: %(default)s)")
+    parser.add_argument("--run-id", help="Only summarize the given run (default: all runs)")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = parser.parse_args()
+    summary = summarize(ResultsStore(args.path).read(args.run_id))
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
@@ -0,0 +1,159 @@
+import bisect
+import functools
+import multiprocessing
+import re
+import threading
+
+# Seconds a substitution may run before its worker process is killed
+DEFAULT_TIMEOUT = 5.0
+PATTERN_CACHE_SIZE = 256
+# Worker processes kept alive between calls
+MAX_IDLE_WORKERS = 4
+# Seconds a new worker may take to start, which re-imports the main module under spawn
+WORKER_START_TIMEOUT = 60.0
+
+# Workers are started with spawn, since forking the multi-threaded agent process is unsafe
+_context = multiprocessing.get_context("spawn")
+
+
+class PatternError(ValueError):
+    pass
+
+
+class MatchTimeout(PatternError):
+    pass
+
+
+@functools.lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def compile_pattern(pattern, flags=0):
+    try:
+        return re.compile(pattern, flags)
+    except re.error as e:
+        raise PatternError(f"Invalid regular expression {pattern!r}: {e}")
+
+
+def _substitute(pattern, flags, replacement, text):
+    """
+    Replaces all matches of pattern in text and returns the new text and the match offsets.
+    """
+    compiled = compile_pattern(pattern, flags)
+    starts = []
+
+    def expand(match):
+        starts.append(match.start())
+        return match.expand(replacement)
+
+    return compiled.sub(expand, text), starts
+
+
+def _serve(connection):
+    connection.send(("ready",))
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            return
+        try:
+            connection.send(("ok", *_substitute(*request)))
+        except Exception as e:
+            connection.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class _RegexWorker:
+    """
+    Process running substitutions, so one stuck in catastrophic backtracking can be killed.
+    Keeps its own compiled-pattern cache across calls. The constructor waits until the process
+    is ready, so its startup does not count towards the timeout of the first substitution.
+    """
+
+    def __init__(self):
+        self.connection, child_connection = _context.Pipe()
+        self.process = _context.Process(target=_serve, args=(child_connection,), daemon=True,
+                                        name="regex-worker")
+        self.process.start()
+        child_connection.close()
+        try:
+            if not self.connection.poll(WORKER_START_TIMEOUT):
+                raise RuntimeError(f"The regex worker did not start within {WORKER_START_TIMEOUT:g} seconds.")
+            self.connection.recv()
+        except BaseException:
+            self.close()
+            raise
+
+    def substitute(self, request, timeout):
+        self.connection.send(request)
+        if not self.connection.poll(timeout):
+            raise MatchTimeout(f"The pattern did not finish within {timeout:g} seconds, it probably backtracks "
+                               f"catastrophically. Use a more specific pattern or literal=True.")
+        return self.connection.recv()
+
+    def close(self):
+        self.connection.close()
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+
+
+_idle_workers = []
+_workers_lock = threading.Lock()
+
+
+def _substitute_in_worker(request, timeout):
+    with _workers_lock:
+        worker = _idle_workers.pop() if _idle_workers else None
+    worker = worker or _RegexWorker()
+    try:
+        result = worker.substitute(request, timeout)
+    except BaseException:
+        worker.close()
+        raise
+    with _workers_lock:
+        if len(_idle_workers) < MAX_IDLE_WORKERS:
+            _idle_workers.append(worker)
+            worker = None
+    if worker is not None:
+        worker.close()
+    if result[0] == "error":
+        raise PatternError(result[1])
+    return result[1], result[2]
+
+
+def find_and_replace(text, pattern, replacement, literal=False, ignore_case=False, expected_count=None,
+                     timeout=DEFAULT_TIMEOUT):
+    """
+    Replaces the matches of pattern in text and returns the new text and the 1-based line numbers
+    of the matches.
+
+    Literal patterns are replaced in-process. Regular expressions are checked here and run in a
+    worker process that is killed after timeout seconds, raising MatchTimeout. If expected_count
+    is given and the number of matches differs, PatternError is raised and nothing is replaced.
+    """
+    if not pattern:
+        raise PatternError("The pattern must not be empty.")
+    if literal:
+        flags = re.IGNORECASE if ignore_case else 0
+        if ignore_case:
+            # Escaped literal patterns are linear, so they need no worker
+            compiled = compile_pattern(re.escape(pattern), flags)
+            starts = [match.start() for match in compiled.finditer(text)]
+            new_text = compiled.sub(lambda match: replacement, text)
+        else:
+            starts = []
+            position = text.find(pattern)
+            while position != -1:
+                starts.append(position)
+                position = text.find(pattern, position + len(pattern))
+            new_text = text.replace(pattern, replacement)
+    else:
+        flags = re.IGNORECASE if ignore_case else 0
+        compile_pattern(pattern, flags)
+        new_text, starts = _substitute_in_worker((pattern, flags, replacement, text), timeout)
+
+    if expected_count is not None and len(starts) != expected_count:
+        raise PatternError(f"Found {len(starts)} match(es), expected {expected_count}; nothing was replaced.")
+    line_offsets = [0]
+    position = text.find("\n")
+    while position != -1:
+        line_offsets.append(position + 1)
+        position = text.find("\n", position + 1)
+    return new_text, [bisect.bisect_right(line_offsets, start) for start in starts]
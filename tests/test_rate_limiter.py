@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+import rate_limiter
+from rate_limiter import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    return clock
+
+
+async def _start(limiter, tokens=0, priority=0):
+    task = asyncio.create_task(limiter.acquire(tokens, priority))
+    await asyncio.sleep(0)
+    return task
+
+
+async def _advance(limiter, clock, seconds):
+    # What the timer of the limiter does once the time has come
+    clock.now += seconds
+    limiter._dispatch()
+    await asyncio.sleep(0)
+
+
+def _scheduled_wait(limiter):
+    return limiter._timer.when() - asyncio.get_running_loop().time()
+
+
+def test_higher_priority_is_admitted_first(clock):
+    async def run():
+        limiter = RateLimiter(requests_per_minute=1)
+        await limiter.acquire()
+        low = await _start(limiter, priority=0)
+        high = await _start(limiter, priority=1)
+        assert not low.done() and not high.done()
+
+        await _advance(limiter, clock, 60)
+        assert high.done() and not low.done()
+        await _advance(limiter, clock, 60)
+        assert low.done()
+
+    asyncio.run(run())
+
+
+def test_recorded_usage_delays_the_next_request(clock):
+    async def run():
+        limiter = RateLimiter(tokens_per_minute=6000)
+        await limiter.acquire(1000)
+        # 3000 tokens more than estimated leave 2000 of the bucket, 1000 short of the next request
+        limiter.record(1000, 4000)
+        waiting = await _start(limiter, 3000)
+        assert _scheduled_wait(limiter) == pytest.approx(10, abs=0.1)
+
+        await _advance(limiter, clock, 9.9)
+        assert not waiting.done()
+        await _advance(limiter, clock, 0.1)
+        assert waiting.done()
+
+    asyncio.run(run())
+
+
+def test_pause_holds_back_all_requests(clock):
+    async def run():
+        limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=60000)
+        limiter.pause(5)
+        waiting = await _start(limiter, 100, priority=1)
+        assert _scheduled_wait(limiter) == pytest.approx(5, abs=0.1)
+
+        await _advance(limiter, clock, 4)
+        assert not waiting.done()
+        await _advance(limiter, clock, 1)
+        assert waiting.done()
+
+    asyncio.run(run())
@@ -0,0 +1,50 @@
+from search_index import RepoSearchIndex
+
+SOURCE = '''\
+class A:
+    """
+    def not_a_method():
+    class NotAClass:
+    """
+    def f(self,
+  value):
+        return (value,
+0)
+
+if TYPE_CHECKING:
+    def g():
+        template = """
+def not_a_function():
+"""
+
+try:
+    import fast
+except ImportError:
+    def h():
+        pass
+
+@decorator
+class B(
+    Base,
+):
+# Comments do not end the class
+    async def m(self):
+        def inner():
+            pass
+        total = 1 + \\
+2
+    def n(self):
+        pass
+'''
+
+
+def test_symbols_follow_statement_structure():
+    assert RepoSearchIndex._extract_symbols(SOURCE) == [
+        ("A", "class", 1),
+        ("A.f", "def", 6),
+        ("g", "def", 12),
+        ("h", "def", 20),
+        ("B", "class", 24),
+        ("B.m", "def", 28),
+        ("B.n", "def", 33),
+    ]
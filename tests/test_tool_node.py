@@ -0,0 +1,99 @@
+import os
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.graph.message import add_messages
+from tool_node import ParallelToolNode, ReadCache
+from tools import read_tools, read_write_tools
+from workspace import Workspace
+
+
+def _run_turns(node, messages_key, messages, turns, config, prefix="c"):
+    for turn, calls in enumerate(turns):
+        tool_calls = [{"name": name, "args": args, "id": f"{prefix}{turn}_{position}", "type": "tool_call"}
+                      for position, (name, args) in enumerate(calls)]
+        messages = add_messages(messages, [AIMessage(content="", tool_calls=tool_calls)])
+        messages = add_messages(messages, node({messages_key: messages}, config)[messages_key])
+    return messages
+
+
+def _assert_every_call_answered_in_order(messages):
+    pending = []
+    answered = []
+    for message in messages:
+        if isinstance(message, AIMessage):
+            assert not pending, f"calls {pending} have no result before the next response"
+            pending = [call["id"] for call in message.tool_calls]
+        elif isinstance(message, ToolMessage):
+            assert message.tool_call_id in pending, f"result of {message.tool_call_id} is not after its call"
+            pending.remove(message.tool_call_id)
+            answered.append(message.tool_call_id)
+    assert not pending
+    assert len(answered) == len(set(answered))
+
+
+def test_cached_read_after_write_is_appended(tmp_path):
+    (tmp_path / "a.py").write_text("a = 1\n")
+    (tmp_path / "b.py").write_text("b = 1\n")
+    config = {"configurable": {"workspace": Workspace(str(tmp_path)), "read_cache": ReadCache()}}
+    node = ParallelToolNode(read_write_tools, messages_key="coder_messages")
+    read_b = ("get_file_content", {"file_path": "b.py", "start_line": 1, "end_line": 1})
+    turns = [
+        [read_b],
+        [("apply_edits", {"edits": [{"file_path": "a.py", "op": "replace", "old": "a = 1", "new": "a = 2"}]})],
+        [read_b],
+    ]
+
+    messages = _run_turns(node, "coder_messages", [HumanMessage(content="Fix it")], turns, config)
+
+    _assert_every_call_answered_in_order(messages)
+    results = [message for message in messages if isinstance(message, ToolMessage)]
+    assert [result.tool_call_id for result in results] == ["c0_0", "c1_0", "c2_0"]
+    assert results[2].content == results[0].content
+    assert results[2].id != results[0].id
+
+
+def test_planner_reads_are_served_to_coder(tmp_path):
+    (tmp_path / "b.py").write_text("b = 1\n")
+    config = {"configurable": {"workspace": Workspace(str(tmp_path)), "read_cache": ReadCache()}}
+    read_b = ("get_file_content", {"file_path": "b.py"})
+    planner_messages = _run_turns(ParallelToolNode(read_tools, messages_key="planner_messages"),
+                                  "planner_messages", [HumanMessage(content="Plan it")], [[read_b]], config, "p")
+    coder_messages = _run_turns(ParallelToolNode(read_write_tools, messages_key="coder_messages"),
+                                "coder_messages", [HumanMessage(content="Fix it")], [[read_b], [read_b]], config)
+
+    _assert_every_call_answered_in_order(coder_messages)
+    planner_result = planner_messages[-1]
+    coder_results = [message for message in coder_messages if isinstance(message, ToolMessage)]
+    assert coder_results[0].content == planner_result.content
+    assert coder_results[0].id != planner_result.id
+    assert coder_results[0].tool_call_id == "c0_0"
+    assert planner_result.tool_call_id == "p0_0"
+
+
+def test_cached_file_read_is_invalidated_by_a_change_on_disk(tmp_path):
+    path = tmp_path / "b.py"
+    path.write_text("b = 1\n")
+    config = {"configurable": {"workspace": Workspace(str(tmp_path)), "read_cache": ReadCache()}}
+    call = {"name": "get_file_content", "args": {"file_path": "b.py"}, "id": "c0_0", "type": "tool_call"}
+    cache = config["configurable"]["read_cache"]
+    cache.put(call, config, ToolMessage(content="b = 1\n", tool_call_id="c0_0", name="get_file_content"))
+    assert cache.get({**call, "id": "c1_0"}, config).tool_call_id == "c1_0"
+
+    path.write_text("b = 22\n")
+    assert cache.get({**call, "id": "c2_0"}, config) is None
+
+
+def test_cached_file_read_is_invalidated_by_an_atomic_replace(tmp_path):
+    path = tmp_path / "b.py"
+    path.write_text("b = 1\n")
+    config = {"configurable": {"workspace": Workspace(str(tmp_path)), "read_cache": ReadCache()}}
+    call = {"name": "get_file_content", "args": {"file_path": "b.py"}, "id": "c0_0", "type": "tool_call"}
+    cache = config["configurable"]["read_cache"]
+    cache.put(call, config, ToolMessage(content="b = 1\n", tool_call_id="c0_0", name="get_file_content"))
+
+    # Same size and modification time, as a replace within one mtime tick leaves them
+    stat = path.stat()
+    replacement = tmp_path / "b.py.tmp"
+    replacement.write_text("b = 2\n")
+    os.utime(replacement, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(replacement, path)
+    assert cache.get({**call, "id": "c1_0"}, config) is None
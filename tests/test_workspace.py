@@ -0,0 +1,39 @@
+import asyncio
+import os
+import subprocess
+import pytest
+from workspace import Workspace
+
+
+def _make_checkout(path):
+    path.mkdir(parents=True)
+    (path / "a.py").write_text("a = 1\n")
+    subprocess.run(["git", "init", "--quiet"], cwd=path, check=True)
+    subprocess.run(["git", "add", "."], cwd=path, check=True)
+    subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com", "commit", "--quiet",
+                    "-m", "init"], cwd=path, check=True)
+    return path
+
+
+async def _read_through_scratch(workspace):
+    await workspace.open()
+    try:
+        assert workspace.root != workspace.checkout
+        with open(workspace.path("a.py"), encoding="utf-8") as file:
+            return file.read()
+    finally:
+        await workspace.close()
+
+
+@pytest.mark.parametrize("scratch", ["relative", "symlinked"])
+def test_scratch_copy_resolves_paths(tmp_path, monkeypatch, scratch):
+    checkout = _make_checkout(tmp_path / "repo_1" / "project")
+    if scratch == "relative":
+        monkeypatch.chdir(tmp_path)
+        scratch_dir = "scratch"
+    else:
+        (tmp_path / "volume").mkdir()
+        os.symlink(tmp_path / "volume", tmp_path / "scratch")
+        scratch_dir = str(tmp_path / "scratch")
+
+    assert asyncio.run(_read_through_scratch(Workspace(str(checkout), scratch_dir))) == "a = 1\n"
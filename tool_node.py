@@ -0,0 +1,162 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from langchain_core.messages import ToolMessage
+from compaction import read_key, repeated_calls
+from metrics import inc
+from tools import READ_ONLY_TOOLS
+
+# Shared by all tool nodes, so concurrent tasks cannot start an unbounded number of threads
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="tool")
+
+REPEATED_CALL_NOTE = ("[Repeated call: you made this exact call before and the repository has not changed since, "
+                      "so this is the same result. Use the results you already have instead of repeating calls.]")
+
+
+class ReadCache:
+    """
+    Results of the read tool calls of one task, shared by the tool nodes of all its agents, so
+    e.g. the coder gets the files the planner read without running the tool again. A file read
+    is valid while the mtime and size of the file are unchanged, any other read until the next
+    write tool call.
+    """
+
+    def __init__(self):
+        self._results = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _file_version(call, config):
+        if call["name"] != "get_file_content":
+            return None
+        try:
+            stat = os.stat(config["configurable"]["workspace"].path(call["args"].get("file_path", "")))
+        except (OSError, KeyError, ValueError):
+            return False
+        # Atomic writes replace the file, so the inode tells them apart within one mtime tick
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def get(self, call, config):
+        with self._lock:
+            entry = self._results.get(read_key(call))
+            generation = self._generation
+        if entry is None:
+            return None
+        message, cached_generation, version = entry
+        if version is None and cached_generation != generation:
+            return None
+        if version is not None and version != self._file_version(call, config):
+            return None
+        # A new message: add_messages would replace an earlier message with the same id in place
+        return message.model_copy(update={"tool_call_id": call["id"], "id": None})
+
+    def put(self, call, config, message):
+        version = self._file_version(call, config)
+        if version is False:
+            return
+        # add_messages sets the id of the message that goes into the state, the cache keeps its own copy
+        message = message.model_copy(update={"id": None})
+        with self._lock:
+            self._results[read_key(call)] = (message, self._generation, version)
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+
+
+class ParallelToolNode:
+    """
+    Graph node executing the tool calls of the last AI message in messages_key.
+
+    Consecutive calls of read-only tools run concurrently on a thread pool. Any other tool call
+    runs on its own, after all earlier calls finished and before any later one starts, so reads
+    in a batch all see the repository as it was at their position in the batch and writes to a
+    file never overlap. The results are returned in the order of the calls.
+
+    A read that repeats an earlier one with nothing written in between is not run again: it gets
+    the earlier result with a note telling the agent to stop repeating itself. Other reads are
+    answered from the ReadCache in config["configurable"]["read_cache"], if there is one.
+    """
+
+    def __init__(self, tools, messages_key, read_only_tools=READ_ONLY_TOOLS):
+        self.tools_by_name = {tool.name: tool for tool in tools}
+        self.messages_key = messages_key
+        self.read_only_tools = read_only_tools
+
+    def _run(self, call, config):
+        tool = self.tools_by_name.get(call["name"])
+        if tool is None:
+            return ToolMessage(
+                content=f"Error: {call['name']} is not a valid tool, try one of [{', '.join(self.tools_by_name)}].",
+                name=call["name"], tool_call_id=call["id"], status="error",
+            )
+        read_cache = config.get("configurable", {}).get("read_cache")
+        if read_cache is not None and call["name"] in self.read_only_tools:
+            cached = read_cache.get(call, config)
+            if cached is not None:
+                inc("tool_calls_cached", tool=call["name"])
+                return cached
+        try:
+            message = tool.invoke({**call, "type": "tool_call"}, config)
+        except Exception as e:
+            error = repr(e)
+            workspace = config.get("configurable", {}).get("workspace")
+            if workspace is not None:
+                # Paths in tool results are relative to the repository, like the paths the model passes in
+                error = workspace.strip_root(error)
+            message = ToolMessage(content=f"Error: {error}\n Please fix your mistakes.",
+                                  name=call["name"], tool_call_id=call["id"], status="error")
+        if read_cache is not None:
+            if call["name"] not in self.read_only_tools:
+                read_cache.invalidate()
+            elif message.status != "error":
+                read_cache.put(call, config, message)
+        return message
+
+    def _run_batch(self, calls, config):
+        if len(calls) == 1:
+            return [self._run(calls[0], config)]
+        futures = [_executor.submit(copy_context().run, self._run, call, config) for call in calls]
+        return [future.result() for future in futures]
+
+    @staticmethod
+    def _repeated_result(call, earlier):
+        inc("tool_calls_repeated", tool=call["name"])
+        return ToolMessage(content=f"{REPEATED_CALL_NOTE}\n{earlier.content}", name=call["name"],
+                           tool_call_id=call["id"], status=earlier.status)
+
+    def __call__(self, state, config):
+        messages = state[self.messages_key]
+        tool_calls = messages[-1].tool_calls
+        repeats = repeated_calls(messages)
+        earlier_results = {message.tool_call_id: message for message in messages if isinstance(message, ToolMessage)}
+        results = [None] * len(tool_calls)
+        batch = []
+
+        def run_batch():
+            for position, result in zip(batch, self._run_batch([tool_calls[position] for position in batch], config)):
+                results[position] = result
+            batch.clear()
+
+        for position, call in enumerate(tool_calls):
+            earlier = earlier_results.get(repeats.get(call["id"]))
+            if earlier is not None:
+                results[position] = self._repeated_result(call, earlier)
+            elif call["name"] in self.read_only_tools:
+                batch.append(position)
+            else:
+                if batch:
+                    run_batch()
+                results[position] = self._run(call, config)
+        if batch:
+            run_batch()
+        return {self.messages_key: results}
+
+    async def ainvoke(self, state, config):
+        """
+        Executes the tool calls without blocking the event loop.
+        """
+        return await asyncio.to_thread(self, state, config)
@@ -1,20 +1,39 @@
 import os
-import re
 import time
+import fnmatch
 import functools
-from langchain.tools import Tool
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
+from file_cache import get_cached_file, invalidate_cached_file
+from file_edits import EditError, apply_edits as apply_file_edits, write_atomic
+from safe_regex import PatternError, find_and_replace as safe_find_and_replace
+from metrics import span
+from repo_index import get_file_index, invalidate_file_index
+from search_index import get_search_index, update_search_index
+from workspace import WorkspaceError
+
+LIST_FILES_PAGE_SIZE = 200
+SEARCH_MAX_RESULTS = 50
+# Seconds a find_and_replace pattern may run before it is aborted
+FIND_AND_REPLACE_TIMEOUT = 5.0
+MAX_REPORTED_MATCH_LINES = 20
+
+# Tools that only read the repository and are safe to run concurrently
+READ_ONLY_TOOLS = {"list_files_in_repository", "search_repository", "get_file_content"}
+# Tools that change the file given as file_path, or the files of their edits
+WRITE_TOOLS = {"overwrite_file", "find_and_replace", "delete_lines", "insert_at_line", "replace_lines", "apply_edits"}
 
 def tool_logger(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
         args_repr = [repr(a) for a in args]
-        kwargs_repr = [f"{k}={v!r}" for k, v in kwargs.items()]
+        kwargs_repr = [f"{k}={v!r}" for k, v in kwargs.items() if k != "config"]
         signature = ", ".join(args_repr + kwargs_repr)
         print(f"Calling tool: {func.__name__}({signature})")
         start_time = time.time()
         try:
-            result = func(*args, **kwargs)
+            with span("tool", tool=func.__name__):
+                result = func(*args, **kwargs)
             end_time = time.time()
             print(f"Tool {func.__name__} executed successfully in {end_time - start_time:.2f} seconds.")
             return result
@@ -24,139 +43,239 @@ def tool_logger(func):
             raise
     return wrapper
 
+def _workspace(config):
+    """
+    Returns the workspace of the task that the agent runtime bound the tool call to.
+    """
+    workspace = (config or {}).get("configurable", {}).get("workspace")
+    if workspace is None:
+        raise WorkspaceError("The tool call is not bound to a workspace.")
+    return workspace
+
+
+def _file_changed(file_path):
+    """
+    Updates the caches and indexes shared by the tools after a write tool changed file_path.
+    """
+    invalidate_cached_file(file_path)
+    update_search_index(file_path)
+
+
 @tool
 @tool_logger
-def list_files_in_repository(repo: str) -> list[str]:
+def list_files_in_repository(config: RunnableConfig, subdirectory: str = "", pattern: str = "",
+                             page: int = 1) -> list[str]:
     """
-    Lists all files in a given repository directory recursively.
+    Lists the files in the repository recursively, ignoring files excluded by .gitignore.
+    Narrow the listing down with subdirectory and pattern instead of paging through the whole repository.
+
+    Args:
+        subdirectory (str): Only list files below this directory, relative to the repository root (default: all).
+        pattern (str): Glob pattern the file path or file name must match, e.g. "*.py" or "tests/*_views.py".
+        page (int): Page of the result to return, starting at 1. Each page holds up to 200 files.
 
     Returns:
-        list: A list of file paths relative to the repository root, or an error message.
+        list: A page of file paths relative to the repository root followed by a paging summary, or an error message.
     """
-    repo_path = f"/Users/jannik/Lokale-Dokumente/University/Msc/ASE/repos/{repo}"
+    workspace = _workspace(config)
+    repo_path = workspace.root
     try:
         if not os.path.exists(repo_path):
-            return [f"Error: Repository path '{repo_path}' does not exist."]
-
-        file_list = []
-        for root, _, files in os.walk(repo_path):
-            for file in files:
-                # Construct the relative file path
-                relative_path = os.path.relpath(os.path.join(root, file), repo_path)
-                file_list.append(relative_path)
-
-        return file_list
+            return ["Error: The repository does not exist."]
+
+        file_list = get_file_index(repo_path)
+        subdirectory = subdirectory.strip("/")
+        if subdirectory and subdirectory != ".":
+            file_list = [path for path in file_list if path.startswith(subdirectory + "/")]
+        if pattern:
+            file_list = [path for path in file_list
+                         if fnmatch.fnmatch(path, pattern) or fnmatch.fnmatch(os.path.basename(path), pattern)]
+
+        pages = max(1, -(-len(file_list) // LIST_FILES_PAGE_SIZE))
+        if page < 1 or page > pages:
+            return [f"Error: Page {page} does not exist, there are {pages} page(s)."]
+        start = (page - 1) * LIST_FILES_PAGE_SIZE
+        result = file_list[start:start + LIST_FILES_PAGE_SIZE]
+        summary = f"Page {page} of {pages} ({len(file_list)} files in total)."
+        if page < pages:
+            summary += f" Call again with page={page + 1} for more, or narrow down with subdirectory or pattern."
+        result.append(summary)
+        return result
     except Exception as e:
-        return [f"Error: An error occurred while listing files: {e}"]
+        return [f"Error: An error occurred while listing files: {workspace.strip_root(e)}"]
 
 
 @tool
 @tool_logger
-def get_file_content(file_path: str, repo: str) -> str:
+def get_file_content(config: RunnableConfig, file_path: str, start_line: int | None = None,
+                     end_line: int | None = None, start_byte: int | None = None, end_byte: int | None = None,
+                     outline: bool = False) -> str:
     """
-    Reads the content of a file and returns it as a string. Always provide the base repo.
+    Reads the content of a file and returns it as a string.
+    Prefer reading only the lines you need: use outline=True to get the classes and functions of a
+    Python file with their line numbers, then read those line ranges.
 
     Args:
-        repo (str): The name of the repository (e.g. repo_1, repo_2)
         file_path (str): Path to the file to be read.
+        start_line (int): First line to read (1-based). Reads from the beginning if omitted.
+        end_line (int): Last line to read (inclusive). Reads to the end if omitted.
+        start_byte (int): First byte to read (0-based), as an alternative to line ranges.
+        end_byte (int): Byte offset to stop reading at (exclusive).
+        outline (bool): Return only the classes and functions of a Python file with their line ranges.
 
     Returns:
-        str: Content of the file or an error message.
+        str: Content of the file (range) or an error message.
     """
-    file_path = f"/Users/jannik/Lokale-Dokumente/University/Msc/ASE/repos/{repo}/{file_path}"
+    workspace = _workspace(config)
+    file_path = workspace.path(file_path)
+    # Paths in results are relative to the repository, like the paths the model passes in
+    shown_path = workspace.relative(file_path)
     try:
-        with open(file_path, "r") as file:
-            return file.read()
+        cached = get_cached_file(file_path)
+        if outline:
+            if not file_path.endswith(".py"):
+                return (f"Error: Outlines are only available for Python files, read '{shown_path}' "
+                        f"by line range instead.")
+            return f"Outline of {shown_path} ({cached.line_count} lines):\n{cached.outline()}"
+        if start_byte is not None or end_byte is not None:
+            start_byte = start_byte or 0
+            if start_byte < 0 or (end_byte is not None and end_byte < start_byte):
+                return f"Error: Invalid byte range {start_byte}-{end_byte}."
+            return cached.byte_range(start_byte, end_byte)
+        if start_line is not None or end_line is not None:
+            start_line = start_line or 1
+            end_line = end_line or cached.line_count
+            if start_line < 1 or start_line > cached.line_count or end_line < start_line:
+                return f"Error: Invalid line range {start_line}-{end_line}, the file has {cached.line_count} lines."
+            end_line = min(end_line, cached.line_count)
+            return (f"Lines {start_line}-{end_line} of {cached.line_count} of {shown_path}:\n"
+                    f"{cached.lines(start_line, end_line)}")
+        return cached.text()
     except FileNotFoundError:
-        return f"Error: File '{file_path}' not found."
+        return f"Error: File '{shown_path}' not found."
     except Exception as e:
-        return f"Error: An error occurred while reading the file: {e}"
+        return f"Error: An error occurred while reading the file: {workspace.strip_root(e)}"
 
 
 @tool
 @tool_logger
-def overwrite_file(repository_name: str, file_path: str, content: str) -> str:
+def search_repository(config: RunnableConfig, query: str, kind: str = "text", path_pattern: str = "",
+                      ignore_case: bool = False) -> list[str]:
+    """
+    Searches the repository using a prebuilt index. Much faster than listing and reading files to find code.
+
+    Args:
+        query (str): For kind="text", the exact text to find, e.g. "def get_prep_value(". For kind="symbol",
+            (part of) the name of a class, function or method, e.g. "QuerySet.filter" or "get_prep_value".
+        kind (str): "text" for a full-text search or "symbol" for class, function and method definitions.
+        path_pattern (str): Glob pattern the file path must match, e.g. "django/db/*" (default: all files).
+        ignore_case (bool): Match text case-insensitively (only for kind="text").
+
+    Returns:
+        list: Up to 50 matches as "path:line: text", or an error message.
+    """
+    workspace = _workspace(config)
+    repo_path = workspace.root
+    try:
+        if not os.path.exists(repo_path):
+            return ["Error: The repository does not exist."]
+        if not query:
+            return ["Error: The query must not be empty."]
+
+        index = get_search_index(repo_path)
+        if kind == "symbol":
+            matches = index.search_symbols(query, path_pattern, SEARCH_MAX_RESULTS)
+            result = [f"{path}:{line}: {symbol_kind} {name}" for path, symbol_kind, name, line in matches]
+        elif kind == "text":
+            matches = index.search_text(query, path_pattern, ignore_case, SEARCH_MAX_RESULTS)
+            result = [f"{path}:{line}: {text}" for path, line, text in matches]
+        else:
+            return [f"Error: Unknown search kind '{kind}', use 'text' or 'symbol'."]
+
+        if not result:
+            return [f"No matches found for {kind} search '{query}'."]
+        if len(result) >= SEARCH_MAX_RESULTS:
+            result.append(f"Only the first {SEARCH_MAX_RESULTS} matches are shown, narrow down the query or path_pattern.")
+        return result
+    except Exception as e:
+        return [f"Error: An error occurred while searching the repository: {workspace.strip_root(e)}"]
+
+
+@tool
+@tool_logger
+def overwrite_file(config: RunnableConfig, file_path: str, content: str) -> str:
     """
     Create a new File with content or Overwrite an existing file with new content.
     
     Args:
-        repository_name (str): The name of the repository (e.g. repo_1, repo_2)
         file_path (str): Path to the file.
         content (str): Content to write or append (default: "").
         
     Returns:
         str: Result of the operation or the content of the file.
     """
-    file_path = f"/Users/jannik/Lokale-Dokumente/University/Msc/ASE/repos/{repository_name}/{file_path}"
+    workspace = _workspace(config)
+    file_path = workspace.path(file_path)
     try:
-        with open(file_path, "w") as file:
-            file.write(content)
-        return f"File {file_path} written successfully."
+        write_atomic(file_path, content.encode("utf-8"))
+        # The other write tools only modify existing files, so only this one can change the listing
+        invalidate_file_index(file_path)
+        _file_changed(file_path)
+        return f"File {workspace.relative(file_path)} written successfully."
     except Exception as e:
-        return f"An error occurred while writing to the file: {e}"
+        return f"An error occurred while writing to the file: {workspace.strip_root(e)}"
 
 
 @tool
 @tool_logger
-def find_and_replace(repository_name: str, file_path: str, pattern: str, replacement: str) -> str:
+def find_and_replace(config: RunnableConfig, file_path: str, pattern: str, replacement: str, literal: bool = False,
+                     ignore_case: bool = False, expected_count: int | None = None) -> str:
     """
     Allows to use search and replace writing operations via Regex expressions.
 
     Args:
-        repository_name (str): The name of the repository (e.g. repo_1, repo_2)
         file_path (str): Path to the file.
-        pattern (str): The regex pattern to replace.
-        replacement (str): Content to replace the pattern with.
+        pattern (str): The regex pattern to replace, or the exact text to replace if literal is True.
+        replacement (str): Content to replace the pattern with. May refer to regex groups as \\1 or \\g<name>.
+        literal (bool): Treat pattern as plain text instead of a regex. Use this for code containing ( [ . * etc.
+        ignore_case (bool): Match case-insensitively.
+        expected_count (int): Number of matches you expect, e.g. 1. If the pattern matches a different number
+            of times, the file is left unchanged.
 
     Returns:
-        str: Result of the operation or the content of the file.
+        str: The number of replaced matches and their line numbers, or an error message.
     """
-    file_path = f"/Users/jannik/Lokale-Dokumente/University/Msc/ASE/repos/{repository_name}/{file_path}"
-
-    print(f"[DEBUG] Starting find_and_replace operation.")
-    print(f"[DEBUG] Repository Name: {repository_name}")
-    print(f"[DEBUG] File Path: {file_path}")
-    print(f"[DEBUG] Regex Pattern: {pattern}")
-    print(f"[DEBUG] Replacement String: {replacement}")
-
+    workspace = _workspace(config)
+    file_path = workspace.path(file_path)
+    shown_path = workspace.relative(file_path)
     try:
-        # Read the file content
-        print(f"[DEBUG] Attempting to read file: {file_path}")
-        with open(file_path, "r", encoding="utf-8") as file:
-            content = file.read()
-        print(f"[DEBUG] File content successfully read. Content length: {len(content)} characters.")
-
-        # Apply the regex replacement
-        print(f"[DEBUG] Applying regex replacement...")
-        modified_content = re.sub(rf"{pattern}", rf"{replacement}", content)
-        print(f"[DEBUG] Regex replacement applied. Modified content length: {len(modified_content)} characters.")
-
-        # Debug: Print a snippet of the modified content
-        print(f"[DEBUG] Modified Content Snippet:\n{modified_content}...")
-
-        # Write the modified content back to the file
-        print(f"[DEBUG] Writing modified content back to file: {file_path}")
-        with open(file_path, "w", encoding="utf-8") as file:
-            file.write(modified_content)
-        print(f"[DEBUG] File successfully updated.")
-
-        return f"FIND AND REPLACE in {file_path} successful!"
+        content = get_cached_file(file_path).data.decode("utf-8")
+        modified_content, match_lines = safe_find_and_replace(content, pattern, replacement, literal, ignore_case,
+                                                              expected_count, FIND_AND_REPLACE_TIMEOUT)
+        if not match_lines:
+            return f"No matches found for the pattern in {shown_path}, the file was not changed."
+        if modified_content != content:
+            write_atomic(file_path, modified_content.encode("utf-8"))
+            _file_changed(file_path)
+        lines = ", ".join(str(line) for line in match_lines[:MAX_REPORTED_MATCH_LINES])
+        if len(match_lines) > MAX_REPORTED_MATCH_LINES:
+            lines += f" and {len(match_lines) - MAX_REPORTED_MATCH_LINES} more"
+        return f"FIND AND REPLACE in {shown_path} successful! Replaced {len(match_lines)} match(es) on line(s) {lines}."
     except FileNotFoundError:
-        error_message = f"[ERROR] File not found: {file_path}"
-        print(error_message)
-        return error_message
+        return f"[ERROR] File not found: {shown_path}"
+    except PatternError as e:
+        return f"[ERROR] {e}"
     except Exception as e:
-        error_message = f"[ERROR] An error occurred during find and replace: {e}"
-        print(error_message)
-        return error_message
+        return f"[ERROR] An error occurred during find and replace: {workspace.strip_root(e)}"
+
+
 @tool
 @tool_logger
-def delete_lines(repository_name: str, file_path: str, start_line: int, end_line: int) -> None:
+def delete_lines(config: RunnableConfig, file_path: str, start_line: int, end_line: int) -> None:
     """
     Delete a range of lines from a file.
 
     Parameters:
-        repository_name (str): The name of the repository (e.g. repo_1, repo_2)
         file_path (str): Path to the target file.
         start_line (int): The starting line number (1-based index) of the range to delete.
         end_line (int): The ending line number (inclusive, 1-based index) of the range to delete.
@@ -169,7 +288,7 @@ def delete_lines(repository_name: str, file_path: str, start_line: int, end_line
         start_line += 1
     if end_line == 0:
         end_line += 1
-    file_path = f"/Users/jannik/Lokale-Dokumente/University/Msc/ASE/repos/{repository_name}/{file_path}"
+    file_path = _workspace(config).path(file_path)
     with open(file_path, 'r', encoding='utf-8') as file:
         lines = file.readlines()
 
@@ -178,18 +297,17 @@ def delete_lines(repository_name: str, file_path: str, start_line: int, end_line
 
     del lines[start_line - 1:end_line]
 
-    with open(file_path, 'w', encoding='utf-8') as file:
-        file.writelines(lines)
+    write_atomic(file_path, "".join(lines).encode("utf-8"))
+    _file_changed(file_path)
 
 
 @tool
 @tool_logger
-def insert_at_line(repository_name: str, file_path: str, line_number: int, content: str) -> None:
+def insert_at_line(config: RunnableConfig, file_path: str, line_number: int, content: str) -> None:
     """
     Insert a line of text at a specific position in a file.
 
     Parameters:
-        repository_name (str): The name of the repository (e.g. repo_1, repo_2)    
         file_path (str): Path to the target file.
         line_number (int): The line number (1-based index) at which to insert the new content.
         content (str): The content to insert into the file.
@@ -200,7 +318,7 @@ def insert_at_line(repository_name: str, file_path: str, line_number: int, conte
     """
     if line_number == 0:
         line_number += 1
-    file_path = f"/Users/jannik/Lokale-Dokumente/University/Msc/ASE/repos/{repository_name}/{file_path}"
+    file_path = _workspace(config).path(file_path)
     with open(file_path, 'r', encoding='utf-8') as file:
         lines = file.readlines()
 
@@ -209,18 +327,18 @@ def insert_at_line(repository_name: str, file_path: str, line_number: int, conte
 
     lines.insert(line_number - 1, content + '\n')
 
-    with open(file_path, 'w', encoding='utf-8') as file:
-        file.writelines(lines)
+    write_atomic(file_path, "".join(lines).encode("utf-8"))
+    _file_changed(file_path)
 
 
 @tool
 @tool_logger
-def replace_lines(repository_name: str, file_path: str, start_line: int, end_line: int, new_content: list[str]) -> None:
+def replace_lines(config: RunnableConfig, file_path: str, start_line: int, end_line: int,
+                  new_content: list[str]) -> None:
     """
     Replace a range of lines in a file with new content.
 
     Parameters:
-        repository_name (str): The name of the repository (e.g. repo_1, repo_2)    
         file_path (str): Path to the target file.
         start_line (int): The starting line number (1-based index) of the range to replace.
         end_line (int): The ending line number (inclusive, 1-based index) of the range to replace.
@@ -235,7 +353,7 @@ def replace_lines(repository_name: str, file_path: str, start_line: int, end_lin
     if end_line == 0:
         end_line += 1
 
-    file_path = f"/Users/jannik/Lokale-Dokumente/University/Msc/ASE/repos/{repository_name}/{file_path}"
+    file_path = _workspace(config).path(file_path)
     with open(file_path, 'r', encoding='utf-8') as file:
         lines = file.readlines()
 
@@ -244,28 +362,75 @@ def replace_lines(repository_name: str, file_path: str, start_line: int, end_lin
 
     lines[start_line - 1:end_line] = [line + '\n' if not line.endswith('\n') else line for line in new_content]
 
-    with open(file_path, 'w', encoding='utf-8') as file:
-        file.writelines(lines)
+    write_atomic(file_path, "".join(lines).encode("utf-8"))
+    _file_changed(file_path)
+
+
+@tool
+@tool_logger
+def apply_edits(config: RunnableConfig, edits: list[dict]) -> str:
+    """
+    Applies several edits to one or more files in a single call, all or nothing. Prefer this over
+    separate write calls: either every edit is applied and every changed Python file still parses,
+    or no file is changed and the error says which edit failed.
+
+    Args:
+        edits (list[dict]): Edits applied in order. Every edit has a "file_path" relative to the
+            repository and an "op":
+            - {"op": "replace", "old": exact text, "new": replacement} replaces text that occurs exactly
+              once; set "count" to the number of occurrences to replace all of them.
+            - {"op": "replace_lines", "start_line": n, "end_line": m, "content": text} replaces lines n-m.
+            - {"op": "insert", "line": n, "content": text} inserts text before line n.
+            - {"op": "delete_lines", "start_line": n, "end_line": m} deletes lines n-m.
+            - {"op": "write", "content": text} replaces the whole file or creates a new one.
+            Line numbers are 1-based and inclusive and refer to the file as left by the previous edits.
+
+    Returns:
+        str: The unified diff of the changes, or an error message.
+    """
+    workspace = _workspace(config)
+    repo_path = workspace.root
+    try:
+        if not os.path.exists(repo_path):
+            return "Error: The repository does not exist."
+        changed, diff = apply_file_edits(repo_path, edits)
+        for relative_path in changed:
+            _file_changed(os.path.join(repo_path, relative_path))
+        # Only whole-file writes can create files and change the listing
+        if any(edit.get("op") == "write" for edit in edits):
+            invalidate_file_index(repo_path)
+        if not changed:
+            return "The edits did not change any file."
+        return f"Applied {len(edits)} edit(s) to {len(changed)} file(s):\n{diff}"
+    except EditError as e:
+        return f"Error: {workspace.strip_root(e)}"
+    except Exception as e:
+        return f"Error: An error occurred while applying the edits, no file was changed: {workspace.strip_root(e)}"
 
 
 tools = [
     list_files_in_repository,
+    search_repository,
     get_file_content,
     # overwrite_file,
     find_and_replace,
     delete_lines,
     insert_at_line,
-    replace_lines
+    replace_lines,
+    apply_edits
 ]
 
 read_tools = [
     list_files_in_repository,
+    search_repository,
     get_file_content
 ]
 
 read_write_tools = [
+    apply_edits,
     find_and_replace,
     list_files_in_repository,
+    search_repository,
     get_file_content
 ]
 
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import shutil
+import tempfile
+from repo_cache import git_output, run_git
+from repo_index import invalidate_file_index
+
+# Directory holding the task checkouts (repo_<index>/<name>), shared with the harness
+REPOS_ROOT = os.path.abspath(os.getenv("REPOS_ROOT") or
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "repos"))
+
+
+class WorkspaceError(ValueError):
+    pass
+
+
+class Workspace:
+    """
+    The repository checkout of one task, which the tools of its agents are bound to. Paths from
+    the model are resolved relative to root and may not leave it.
+
+    With a scratch_dir, e.g. on tmpfs, open() creates a disposable copy of the checkout there
+    that shares its git objects, and the agents work on that copy. sync() carries the changes
+    of the copy over to the checkout, where the harness evaluates them.
+    """
+
+    def __init__(self, checkout, scratch_dir=None):
+        self.checkout = os.path.realpath(checkout)
+        self.scratch_dir = os.path.realpath(scratch_dir) if scratch_dir is not None else None
+        self.root = self.checkout
+        self._scratch_parent = None
+
+    def __repr__(self):
+        return f"Workspace({self.root!r})"
+
+    @property
+    def name(self):
+        return os.path.basename(self.checkout)
+
+    def path(self, relative_path=""):
+        """
+        Returns the absolute path of a path relative to the workspace root.
+        """
+        path = os.path.realpath(os.path.join(self.root, str(relative_path).lstrip("/")))
+        if path != self.root and not path.startswith(self.root + os.sep):
+            raise WorkspaceError(f"'{relative_path}' is outside the repository.")
+        return path
+
+    def relative(self, path):
+        """
+        Returns an absolute path below the workspace root relative to it, as shown to the model.
+        """
+        return os.path.relpath(path, self.root)
+
+    def strip_root(self, text):
+        """
+        Replaces the workspace root in text, e.g. an error message, with paths relative to it.
+        """
+        return str(text).replace(self.root + os.sep, "").replace(self.root, ".")
+
+    async def open(self, env=None):
+        if self.scratch_dir is None or self._scratch_parent is not None:
+            return self
+        os.makedirs(self.scratch_dir, exist_ok=True)
+        task_dir = os.path.basename(os.path.dirname(self.checkout))
+        self._scratch_parent = tempfile.mkdtemp(dir=self.scratch_dir, prefix=f"{task_dir}-")
+        scratch = os.path.join(self._scratch_parent, self.name)
+        try:
+            head = (await git_output("rev-parse", "HEAD", cwd=self.checkout, env=env)).decode().strip()
+            await run_git("clone", "--shared", "--quiet", "--no-checkout", self.checkout, scratch, env=env)
+            await run_git("checkout", "--quiet", "--detach", head, cwd=scratch, env=env)
+            # Changes already in the checkout, e.g. of a resumed agent run
+            diff = await _working_tree_diff(self.checkout, env)
+            if diff:
+                await git_output("apply", "--binary", "-", cwd=scratch, env=env, input=diff)
+        except BaseException:
+            await asyncio.to_thread(shutil.rmtree, self._scratch_parent, True)
+            self._scratch_parent = None
+            raise
+        self.root = scratch
+        return self
+
+    async def sync(self, env=None):
+        """
+        Makes the checkout match the scratch copy, as a diff against their common commit.
+        """
+        if self.root == self.checkout:
+            return
+        diff = await _working_tree_diff(self.root, env)
+        await run_git("reset", "--quiet", "--hard", cwd=self.checkout, env=env)
+        await run_git("clean", "--quiet", "--force", "-d", cwd=self.checkout, env=env)
+        if diff:
+            await git_output("apply", "--binary", "-", cwd=self.checkout, env=env, input=diff)
+        invalidate_file_index(self.checkout)
+
+    async def close(self):
+        invalidate_file_index(self.root)
+        if self._scratch_parent is not None:
+            await asyncio.to_thread(shutil.rmtree, self._scratch_parent, True)
+            self._scratch_parent = None
+            self.root = self.checkout
+
+
+async def _working_tree_diff(repo_path, env=None):
+    # Intent-to-add makes new files part of the diff
+    await run_git("add", "--all", "--intent-to-add", cwd=repo_path, env=env)
+    return await git_output("diff", "--binary", "HEAD", cwd=repo_path, env=env)